@@ -26,6 +26,7 @@ REQUIRED = [
 # What packages are optional?
 EXTRAS = {
     # 'fancy feature': ['django'],
+    'curl': ['pycurl'],
 }
 
 # The rest you shouldn't have to touch too much :)
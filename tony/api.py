@@ -1,8 +1,10 @@
+import os
+import time
 import asyncio
 import socket
 
 from .broadcaster import Broadcaster
-from .utils import CONSTANTS
+from .utils import CONSTANTS, log
 
 class GameAPIConnector:
 
@@ -16,25 +18,42 @@ class GameAPIConnector:
         self.sockReader, self.sockerWriter = None, None
 
     def __del__(self):
-        self.clear()
+        ## Can't await here, closing transport is enough to free the socket
+        if self.sockerWriter:
+            self.sockerWriter.close()
 
     async def clear(self):
         if self.sockerWriter:
             self.sockerWriter.close()
-            await self.sockerWriter.wait_closed()
+            try:
+                await self.sockerWriter.wait_closed()
+            except OSError:
+                pass
 
         self.sockReader, self.sockerWriter = None, None
 
-    async def __write(self, sData):
-        self.sockerWriter.write("{}{}\n".format(self.GAME_HEADER, sData).encode("utf-8"))
+    def is_alive(self) -> bool:
+        return self.sockerWriter is not None and not self.sockerWriter.is_closing() and not self.sockReader.at_eof()
+
+    async def __write(self, *lData):
+        ## Calls go out in one write, game answers them in order
+        self.sockerWriter.write("".join("{}{}\n".format(self.GAME_HEADER, sData) for sData in lData).encode("utf-8"))
         await self.sockerWriter.drain()
 
     async def __read(self):
-        sRed = await self.sockReader.read(128)
-        if sRed.find(b"\x00") != -1:
-            sRed = sRed[sRed.rfind(b"\x00") + 1:]
+        ## Every reply ends with newline, binary handshake in front of it ends with NUL
+        while True:
+            try:
+                sRed = await self.sockReader.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e:
+                raise ConnectionResetError("Game closed API connection") from e
 
-        return sRed.decode("ascii", "ignore").replace("\r", "").replace("\n", " ")
+            if sRed.find(b"\x00") != -1:
+                sRed = sRed[sRed.rfind(b"\x00") + 1:]
+
+            sRed = sRed.decode("ascii", "ignore").replace("\r", "").replace("\n", "")
+            if len(sRed) > 0:
+                return sRed
 
     def get_connection_info(self):
         return self.lConnectionInfo
@@ -50,7 +69,7 @@ class GameAPIConnector:
 
         return "ON"
 
-    async def send_call(self, sCall):
+    async def authenticate(self):
         ## Establish connection
         sStatus = await self.establish_connection(self.WRITE_TIMEOUT)
         if sStatus == "OFF":
@@ -58,18 +77,99 @@ class GameAPIConnector:
 
         ## Send password
         await self.__write(CONSTANTS["GAME_API_PASS"])
-        sRes = await self.__read()
-        if sRes.find("SUCCESS") == -1:
-            return sRes
+        return await self.__read()
 
+    async def call(self, sCall):
         ## Send call
         await self.__write(sCall)
 
         ## Return result
-        sRes = await self.__read()
-        return sRes
+        return await self.__read()
+
+    async def call_batch(self, lCalls: list[str]) -> list[str]:
+        ## Pipeline calls, one round trip for the whole batch
+        if len(lCalls) == 0:
+            return []
+
+        await self.__write(*lCalls)
+        return [await self.__read() for _ in lCalls]
+
+class GameAPIPool:
+    ## One authenticated connection per game endpoint, shared by all requests
+    def __init__(self):
+        self.dConnections: dict[tuple, GameAPIConnector] = {}
+        self.dLocks: dict[tuple, asyncio.Lock] = {}
+
+    def get_lock(self, tKey: tuple) -> asyncio.Lock:
+        if not tKey in self.dLocks:
+            self.dLocks[tKey] = asyncio.Lock()
+
+        return self.dLocks[tKey]
+
+    async def send_call(self, lConnectionInfo: list, sCall: str, iTimeout: int = GameAPIConnector.WRITE_TIMEOUT, rBroadcaster: Broadcaster = None):
+        return await self.__run(lConnectionInfo, lambda rConnector: rConnector.call(sCall), iTimeout, rBroadcaster)
+
+    async def send_batch(self, lConnectionInfo: list, lCalls: list[str], iTimeout: int = GameAPIConnector.WRITE_TIMEOUT, rBroadcaster: Broadcaster = None):
+        ## Returns replies in order of calls, or whatever authentication gave back if it didn't pass
+        return await self.__run(lConnectionInfo, lambda rConnector: rConnector.call_batch(lCalls), iTimeout, rBroadcaster)
+
+    async def __run(self, lConnectionInfo: list, fnCall, iTimeout: int, rBroadcaster: Broadcaster):
+        tKey = tuple(lConnectionInfo)
+        ## Connection serves one caller at a time, otherwise replies would mix up
+        async with self.get_lock(tKey):
+            for iTry in range(2):
+                rConnector = await self.__get_connection(tKey, iTimeout, rBroadcaster)
+                if not isinstance(rConnector, GameAPIConnector):
+                    return rConnector ## Game is off or refused our password
+
+                try:
+                    return await asyncio.wait_for(fnCall(rConnector), timeout=iTimeout)
+                except (asyncio.TimeoutError, asyncio.CancelledError):
+                    ## Timed out or cancelled midway, late reply would confuse next caller
+                    await self.drop(tKey)
+                    raise
+                except OSError:
+                    ## Stale connection, reconnect once and try again
+                    await self.drop(tKey)
+                    if iTry > 0:
+                        return None
+
+    async def drop(self, tKey: tuple) -> None:
+        rConnector = self.dConnections.pop(tKey, None)
+        if rConnector:
+            await rConnector.clear()
+
+    async def close(self) -> None:
+        for tKey in list(self.dConnections):
+            await self.drop(tKey)
+
+    async def __get_connection(self, tKey: tuple, iTimeout: int, rBroadcaster: Broadcaster):
+        rConnector = self.dConnections.get(tKey)
+        if rConnector and rConnector.is_alive():
+            return rConnector
+
+        await self.drop(tKey)
+        rConnector = GameAPIConnector(tKey, rBroadcaster)
+        try:
+            sRes = await asyncio.wait_for(rConnector.authenticate(), timeout=iTimeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            await rConnector.clear()
+            raise
+        except OSError:
+            sRes = None
+
+        if not sRes or sRes.find("SUCCESS") == -1:
+            await rConnector.clear()
+            return sRes
+
+        self.dConnections[tKey] = rConnector
+        return rConnector
 
 class GameStatusChecker(GameAPIConnector):
+
+    READY_INITIAL_DELAY: float = 0.25
+    READY_MAX_DELAY: float = 5.0
+
     def __init__(self, rBroadcaster):
         super().__init__([], rBroadcaster)
         self.rBroadcaster = rBroadcaster
@@ -81,20 +181,51 @@ class GameStatusChecker(GameAPIConnector):
     async def check_channels_status(self):
         await self.rBroadcaster.send("Checking server status..")
 
+        ## Probe game and auth at once, whole check takes one timeout at most
+        lPorts = CONSTANTS["GAME_PORTS"] + [CONSTANTS["GAME_AUTH_PORT"]]
+        lResults = await asyncio.gather(*(self.probe(iPortNum) for iPortNum in lPorts))
+
         sReturnStr = ""
-        ## Check game
-        for iNum, iPortNum in enumerate(CONSTANTS["GAME_PORTS"]):
-            self.lConnectionInfo = (CONSTANTS["GAME_HOST"], iPortNum)
-            sRes = await self.establish_connection(self.STATUS_CHECK_TIMEOUT)
+        ## Keep configured order of channels
+        for iNum, (sRes, _) in enumerate(lResults[:-1]):
             sReturnStr += f"{CONSTANTS['GAME_PORTS_NAME'][iNum]} status: *{sRes}*\n"
 
-        ## Check auth
-        self.lConnectionInfo = (CONSTANTS["GAME_HOST"], CONSTANTS["GAME_AUTH_PORT"])
-        sRes = await self.establish_connection(self.STATUS_CHECK_TIMEOUT)
-        sReturnStr += f"Auth status: *{sRes}*\n"
+        sReturnStr += f"Auth status: *{lResults[-1][0]}*\n"
 
         await self.rBroadcaster.send(sReturnStr)
 
+    async def probe(self, iPortNum) -> tuple[str, float]:
+        ## Own connector per probe, so parallel checks don't share a socket
+        rConnector = GameAPIConnector((CONSTANTS["GAME_HOST"], iPortNum), self.rBroadcaster)
+        ttStart = time.time()
+        sRes = await rConnector.establish_connection(self.STATUS_CHECK_TIMEOUT)
+        fLatency = time.time() - ttStart
+        await rConnector.clear()
+        return sRes, fLatency
+
+    async def wait_for_port(self, iPortNum, sWantedStatus: str = "ON", iTimeout: int = 120) -> float | None:
+        ## Poll with growing pauses until port reaches wanted status, return how long it took
+        ttStart = time.time()
+        fDelay = self.READY_INITIAL_DELAY
+        while True:
+            sRes, _ = await self.probe(iPortNum)
+            if sRes == sWantedStatus:
+                return time.time() - ttStart
+
+            fRemaining = ttStart + iTimeout - time.time()
+            if fRemaining <= 0:
+                return None
+
+            await asyncio.sleep(min(fDelay, fRemaining))
+            fDelay = min(fDelay * 2, self.READY_MAX_DELAY)
+
+    async def wait_for_ready(self, iTimeout: int = 120) -> dict:
+        ## Every channel and auth are probed at once, each reports its own time
+        lNames = CONSTANTS["GAME_PORTS_NAME"][:len(CONSTANTS["GAME_PORTS"])] + ["Auth"]
+        lPorts = CONSTANTS["GAME_PORTS"] + [CONSTANTS["GAME_AUTH_PORT"]]
+        lTimes = await asyncio.gather(*(self.wait_for_port(iPortNum, "ON", iTimeout) for iPortNum in lPorts))
+        return dict(zip(lNames, lTimes))
+
 class GameReloader(GameAPIConnector):
 
     RELOAD_TYPES : dict = {
@@ -102,6 +233,7 @@ class GameReloader(GameAPIConnector):
         "PROTO" : "RELOAD_PROTOS",
         "ALL" : "RELOAD_ALL",
     }
+    RELOAD_TIMEOUT: int = int(os.getenv("RELOAD_TIMEOUT", str(GameAPIConnector.WRITE_TIMEOUT)))
 
     def __init__(self, rBroadcaster):
         super().__init__([], rBroadcaster)
@@ -118,23 +250,41 @@ class GameReloader(GameAPIConnector):
 
         await self.rBroadcaster.send("Reloading server as requested..")
 
-        sRes = ""
-        for iNum, iPortNum in enumerate(CONSTANTS["GAME_PORTS"]):
-            self.lConnectionInfo = (CONSTANTS["GAME_HOST"], iPortNum)
-            sStat = ""
+        sType = sType.upper()
+        lChannels = list(range(len(CONSTANTS["GAME_PORTS"])))
+        if sType == "PROTO":
+            ## Protos are shared, one channel is enough
+            await self.__reload_channel(0, self.RELOAD_TYPES[sType])
+            await self.rBroadcaster.send("Protos have been reloaded!")
+            return
+
+        lResults = []
+        if sType == "ALL":
+            ## We need to reload proto only once, first channel does it before the rest goes
+            lResults.append(await self.__reload_channel(0, self.RELOAD_TYPES[sType]))
+            lChannels = lChannels[1:]
+            sType = "LOCALE"
+
+        ## Rest of channels reload side by side, hung one can't hold the others
+        lResults += await asyncio.gather(*(self.__reload_channel(iNum, self.RELOAD_TYPES[sType]) for iNum in lChannels))
+        await self.rBroadcaster.send("".join(lResults))
+
+    async def __reload_channel(self, iNum: int, sCall: str) -> str:
+        sName = CONSTANTS['GAME_PORTS_NAME'][iNum]
+        try:
+            sStat = await GameAPIPool_Singleton.send_call((CONSTANTS["GAME_HOST"], CONSTANTS["GAME_PORTS"][iNum]), sCall, self.RELOAD_TIMEOUT, self.rBroadcaster)
+        except asyncio.TimeoutError:
+            return f"Reload of {sName} timed out after {self.RELOAD_TIMEOUT}s!\n"
+        except Exception as e:
+            ## One broken channel must not take results of the others with it
+            log(f"Reload of {sName} failed: {type(e).__name__}: {e}", "error")
+            return f"Reload of {sName} failed: {type(e).__name__}: {e}\n"
 
-            if sType != "ALL":
-                sStat = await self.send_call(self.RELOAD_TYPES[sType.upper()])
-            else:
-                sStat = await self.send_call(self.RELOAD_TYPES[sType.upper()] if iNum == 0 else "LOCALE") ## We need to reload proto only once
+        if not sStat:
+            return f"Cannot reload {sName} because it's off!\n"
 
-            if not sStat:
-                sRes += f"Cannot reload {CONSTANTS['GAME_PORTS_NAME'][iNum]} because it's off!\n"
-            else:
-                sRes += f"Return message from {CONSTANTS['GAME_PORTS_NAME'][iNum]}: *{sStat}*\n"
+        return f"Return message from {sName}: *{sStat}*\n"
 
-            if sType.upper() == "PROTO":
-                await self.rBroadcaster.send("Protos have been reloaded!")
-                return ## We do not need to iterate further
 
-        await self.rBroadcaster.send(sRes)
+## Singleton class for game api connections
+GameAPIPool_Singleton = GameAPIPool()
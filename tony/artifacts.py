@@ -0,0 +1,121 @@
+import os
+import shutil
+
+from tornado.ioloop import IOLoop
+from .utils import CONSTANTS, log
+
+class ArtifactStore:
+
+    STORE_DIRECTORY: str = os.getenv("ARTIFACT_STORE_DIRECTORY", os.path.join(CONSTANTS["STATE_DIRECTORY"], "artifacts"))
+    STORE_LIMIT: int = int(os.getenv("ARTIFACT_STORE_LIMIT_MB", "2048")) * 1024 * 1024
+
+    def __init__(self, sBaseDir: str = CONSTANTS["BASE_DIRECTORY"], lBinaries: list[str] = CONSTANTS["CORE_BINARIES"]):
+        self.sBaseDir = sBaseDir
+        self.lBinaries = lBinaries
+
+    def is_enabled(self) -> bool:
+        return len(self.lBinaries) > 0 and self.STORE_LIMIT > 0
+
+    def get_entry(self, sHead: str) -> str:
+        return os.path.join(self.STORE_DIRECTORY, sHead)
+
+    def has(self, sHead: str) -> bool:
+        return self.is_enabled() and len(sHead) > 0 and os.path.isdir(self.get_entry(sHead))
+
+    ## Copying hundreds of megs would freeze the loop, keep it on executor
+    async def store(self, sHead: str) -> bool:
+        if not self.is_enabled() or len(sHead) == 0:
+            return False
+
+        return await IOLoop.current().run_in_executor(None, self.__store, sHead)
+
+    async def restore(self, sHead: str) -> bool:
+        if not self.has(sHead):
+            return False
+
+        return await IOLoop.current().run_in_executor(None, self.__restore, sHead)
+
+    def __store(self, sHead: str) -> bool:
+        sEntry = self.get_entry(sHead)
+        sTmpEntry = f"{sEntry}.tmp"
+        try:
+            shutil.rmtree(sTmpEntry, ignore_errors=True)
+            for sPath in self.lBinaries:
+                sTarget = os.path.join(sTmpEntry, sPath)
+                os.makedirs(os.path.dirname(sTarget), exist_ok=True)
+                shutil.copy2(os.path.join(self.sBaseDir, sPath), sTarget)
+
+            ## Entry shows up only when it's complete
+            shutil.rmtree(sEntry, ignore_errors=True)
+            os.replace(sTmpEntry, sEntry)
+        except OSError as e:
+            log(f"Couldn't store artifacts for {sHead}: {e}", "warning")
+            shutil.rmtree(sTmpEntry, ignore_errors=True)
+            return False
+
+        self.__evict(sHead)
+        return True
+
+    def __restore(self, sHead: str) -> bool:
+        sEntry = self.get_entry(sHead)
+        lStaged = []
+        try:
+            ## Stage every binary first, a failed copy leaves the current build untouched
+            for sPath in self.lBinaries:
+                sTarget = os.path.join(self.sBaseDir, sPath)
+                sTmpTarget = f"{sTarget}.tony"
+                shutil.copy2(os.path.join(sEntry, sPath), sTmpTarget)
+                lStaged.append((sTmpTarget, sTarget))
+
+                ## Keep owner of replaced binary, server user has to be able to run it
+                if os.path.exists(sTarget):
+                    rStat = os.stat(sTarget)
+                    os.chown(sTmpTarget, rStat.st_uid, rStat.st_gid)
+        except OSError as e:
+            log(f"Couldn't restore artifacts for {sHead}: {e}", "warning")
+            for sTmpTarget, _ in lStaged:
+                self.__remove(sTmpTarget)
+            return False
+
+        try:
+            ## Rename instead of overwrite, running binary may still be mapped
+            for sTmpTarget, sTarget in lStaged:
+                os.replace(sTmpTarget, sTarget)
+        except OSError as e:
+            log(f"Couldn't swap artifacts for {sHead}, binaries may be mixed now: {e}", "error")
+            for sTmpTarget, _ in lStaged:
+                self.__remove(sTmpTarget)
+            return False
+
+        ## Mark as recently used
+        os.utime(sEntry, None)
+        return True
+
+    def __remove(self, sPath: str) -> None:
+        try:
+            os.remove(sPath)
+        except FileNotFoundError:
+            pass
+
+    def __evict(self, sKeep: str) -> None:
+        ## Drop least recently used builds until store fits its limit
+        lEntries = []
+        for sName in os.listdir(self.STORE_DIRECTORY):
+            sEntry = os.path.join(self.STORE_DIRECTORY, sName)
+            if sName.endswith(".tmp") or not os.path.isdir(sEntry):
+                continue
+
+            iSize = sum(os.path.getsize(os.path.join(sRoot, sFile)) for sRoot, _, lFiles in os.walk(sEntry) for sFile in lFiles)
+            lEntries.append((os.path.getmtime(sEntry), sName, iSize))
+
+        iTotal = sum(iSize for _, _, iSize in lEntries)
+        for _, sName, iSize in sorted(lEntries):
+            if iTotal <= self.STORE_LIMIT:
+                break
+
+            if sName == sKeep:
+                continue
+
+            log(f"Evicting stored build {sName} from artifact store", "info")
+            shutil.rmtree(os.path.join(self.STORE_DIRECTORY, sName), ignore_errors=True)
+            iTotal -= iSize
@@ -1,19 +1,52 @@
+import os
+import asyncio
+
 from shlex import quote
 from .task import BaseTask
-from .utils import beautify_results, CONSTANTS
+from .gitrefs import GitRefReader_Singleton, GitStateCache_Singleton
+from .utils import beautify_results, CONSTANTS, log
 from .broadcaster import Broadcaster
 
 class BranchManagement(BaseTask):
     class BranchManager(BaseTask):
 
         CURRENT_BRANCH: str = "git branch --show-current"
+        CURRENT_HEAD: str = "git rev-parse HEAD"
         SWITCH_BRANCH: str = "git switch {}"
         LIST_BRANCH: str = "git branch -r"
         RESET_BRANCH: str = "git reset --hard origin/{}"
 
-        def __init__(self, rBroadcaster: Broadcaster, sRelativePath: str, sFullPath: str = ""):
+        ## Full mode pulls everything, others fetch only the branch they need
+        FULL_SYNC: str = "full"
+        SHALLOW_SYNC: str = "shallow"
+        PARTIAL_SYNC: str = "partial"
+
+        FETCH_BRANCH: str = "git fetch --no-tags {} origin {}"
+        FORCE_SWITCH_BRANCH: str = "git switch --force -C {0} origin/{0}"
+        LIST_REMOTE: str = "git ls-remote --heads origin"
+        FETCH_DEPTH: int = int(os.getenv("GIT_FETCH_DEPTH", "1"))
+        FETCH_FILTER: str = os.getenv("GIT_FETCH_FILTER", "blob:none")
+        PULL_TIMEOUT: int = int(os.getenv("GIT_PULL_TIMEOUT", str(60*30))) ## Large repositories take a while to come
+
+        def __init__(self, rBroadcaster: Broadcaster, sRelativePath: str, sFullPath: str = "", sName: str = ""):
             super().__init__(rBroadcaster)
+            self.sName = sName
             self.sFullPath = "cd {}/{}".format(CONSTANTS["BASE_DIRECTORY"], sRelativePath) if len(sFullPath) == 0 else ("cd " + sFullPath)
+            self.sDirectory = os.path.normpath(self.sFullPath[3:])
+            self.sSyncMode = self.get_sync_mode()
+
+        def get_sync_mode(self) -> str:
+            sMode = os.getenv(f"GIT_SYNC_MODE_{self.sName.upper()}", self.FULL_SYNC).strip().lower()
+            if not sMode in (self.FULL_SYNC, self.SHALLOW_SYNC, self.PARTIAL_SYNC):
+                log(f"Unknown sync mode {sMode} for {self.sName} repository, falling back to {self.FULL_SYNC}", "warning")
+                return self.FULL_SYNC
+
+            return sMode
+
+        ## Fetch single branch into its remote tracking ref, depth or filter keep transfer small
+        def get_fetch_command(self, sBranch: str) -> str:
+            sOption = f"--depth={self.FETCH_DEPTH}" if self.sSyncMode == self.SHALLOW_SYNC else f"--filter={quote(self.FETCH_FILTER)}"
+            return self.FETCH_BRANCH.format(sOption, quote(f"+refs/heads/{sBranch}:refs/remotes/origin/{sBranch}"))
 
         ## Walk into the directory and pull changes if required
         def prepare_directory(self, bDoNotUpdate: bool = False) -> None:
@@ -24,6 +57,16 @@ class BranchManagement(BaseTask):
 
         ## Fetch current branch and return results
         async def get_current_branch(self, **kwargs) -> str:
+            ## Read it from request's memory or refs if we can, git is asked only when they don't tell
+            sBranch = GitStateCache_Singleton.get(self.sDirectory, GitStateCache_Singleton.BRANCH)
+            if sBranch is None:
+                sBranch = GitRefReader_Singleton.get_current_branch(self.sDirectory)
+
+            if sBranch is not None:
+                self.lResults = [0, sBranch, ""]
+                GitStateCache_Singleton.set(self.sDirectory, GitStateCache_Singleton.BRANCH, sBranch)
+                return self.lResults[1]
+
             ## Walk directory
             self.prepare_directory(True)
 
@@ -31,13 +74,52 @@ class BranchManagement(BaseTask):
             self.lCommand.append((self.CURRENT_BRANCH, "Checking the branch.."))
 
             await self.run(**kwargs)
+            if self.check_results():
+                GitStateCache_Singleton.set(self.sDirectory, GitStateCache_Singleton.BRANCH, self.lResults[1].strip())
+
             return self.lResults[1]
 
+        ## Fetch commit sha of HEAD
+        async def get_head(self, **kwargs) -> str:
+            sHead = GitStateCache_Singleton.get(self.sDirectory, GitStateCache_Singleton.HEAD)
+            if sHead is None:
+                sHead = GitRefReader_Singleton.get_head(self.sDirectory)
+
+            if sHead is not None:
+                self.lResults = [0, sHead, ""]
+                GitStateCache_Singleton.set(self.sDirectory, GitStateCache_Singleton.HEAD, sHead)
+                return sHead
+
+            ## Walk directory
+            self.prepare_directory(True)
+
+            ## Fetch sha
+            self.lCommand.append((self.CURRENT_HEAD, ""))
+
+            await self.run(**kwargs)
+            if not self.check_results():
+                return ""
+
+            GitStateCache_Singleton.set(self.sDirectory, GitStateCache_Singleton.HEAD, self.lResults[1].strip())
+            return self.lResults[1].strip()
+
         ## Switch branch to provided by post
         async def switch_branch(self, sBranch: str, **kwargs) -> None:
+            ## Whatever we knew about the repository is gone now
+            GitStateCache_Singleton.forget(self.sDirectory)
+
             ## Walk directory
             self.prepare_directory(True)
 
+            if self.sSyncMode != self.FULL_SYNC:
+                ## Bring just that branch and jump on it, it's up to date already
+                self.lCommand.append((self.get_fetch_command(sBranch), f"Fetching branch {quote(sBranch)}.."))
+                self.lCommand.append((self.FORCE_SWITCH_BRANCH.format(quote(sBranch)), f"Switching branch to {quote(sBranch)}.."))
+                await self.run(iTimeout = self.PULL_TIMEOUT, **kwargs)
+
+                GitStateCache_Singleton.set(self.sDirectory, GitStateCache_Singleton.PULLED, self.check_results())
+                return
+
             ## Reset branch
             self.lCommand.append((self.RESET_BRANCH.format(sBranch), "Resetting branch.."))
 
@@ -50,18 +132,50 @@ class BranchManagement(BaseTask):
 
         ## Return list of existing branches
         async def list_branch(self, **kwargs) -> str:
+            if self.sSyncMode != self.FULL_SYNC:
+                return await self.list_remote_branch(**kwargs)
+
+            ## Pull refreshes remote refs, list is read from them afterwards
+            if GitStateCache_Singleton.get(self.sDirectory, GitStateCache_Singleton.PULLED) is True:
+                ## This request pulled already, refs are fresh
+                self.lResults = [0, "", ""]
+            else:
+                self.prepare_directory()
+                await self.run(iTimeout = self.PULL_TIMEOUT, **kwargs)
+
+            if self.check_results():
+                lBranches = GitRefReader_Singleton.list_remote_branches(self.sDirectory)
+                if lBranches is not None:
+                    self.lResults = [0, "\n".join(lBranches), ""]
+                else:
+                    ## List branches and return beautified results
+                    self.prepare_directory(True)
+                    self.lCommand.append((self.LIST_BRANCH, "Fetching actual branches.."))
+                    await self.run(**kwargs)
+
+            ## Beautify results
+            self.lResults[1] = beautify_results(self.lResults[1])
+            return self.lResults[1]
+
+        ## Ask remote for its branches, nothing is downloaded
+        async def list_remote_branch(self, **kwargs) -> str:
             ## Walk directory
-            self.prepare_directory()
+            self.prepare_directory(True)
 
-            ## List branches and return beautified results
-            self.lCommand.append((self.LIST_BRANCH, "Fetching actual branches.."))
+            self.lCommand.append((self.LIST_REMOTE, "Fetching actual branches.."))
             await self.run(**kwargs)
+            if self.check_results():
+                lBranches = [sLine.split("\t")[1][len("refs/heads/"):] for sLine in self.lResults[1].splitlines() if sLine.find("\trefs/heads/") != -1]
+                self.lResults[1] = "\n".join(sorted(lBranches))
 
-            ## Beautify results
-            self.lResults[1] = beautify_results(self.lResults[1])
             return self.lResults[1]
 
         async def update_repository(self, **kwargs) -> None:
+            ## Repository was already reset and pulled within this request
+            if GitStateCache_Singleton.get(self.sDirectory, GitStateCache_Singleton.PULLED):
+                self.lResults = [0, "Already up to date.", ""]
+                return
+
             ## Get branch name
             sBranchName = await self.get_current_branch(bSilentCall = True)
             sBranchName = sBranchName.strip()
@@ -69,22 +183,31 @@ class BranchManagement(BaseTask):
             ## Walk directory
             self.prepare_directory(True)
 
-            ## Reset branch
-            self.lCommand.append((self.RESET_BRANCH.format(sBranchName), f"Resetting branch {sBranchName}.."))
+            if self.sSyncMode != self.FULL_SYNC:
+                ## Fetch only running branch, then move onto it
+                self.lCommand.append((self.get_fetch_command(sBranchName), "Fetching recent changes.."))
+                self.lCommand.append((self.RESET_BRANCH.format(quote(sBranchName)), f"Resetting branch {sBranchName}.."))
+            else:
+                ## Reset branch
+                self.lCommand.append((self.RESET_BRANCH.format(sBranchName), f"Resetting branch {sBranchName}.."))
 
-            ## Now update
-            self.lCommand.append(("git pull", "Pulling recent changes.."))
-            await self.run(**kwargs)
+                ## Now update
+                self.lCommand.append(("git pull", "Pulling recent changes.."))
+
+            await self.run(iTimeout = self.PULL_TIMEOUT, **kwargs)
+
+            GitStateCache_Singleton.forget(self.sDirectory, GitStateCache_Singleton.HEAD)
+            GitStateCache_Singleton.set(self.sDirectory, GitStateCache_Singleton.PULLED, self.check_results())
 
     def __init__(self, rBroadcaster: Broadcaster):
         super().__init__(rBroadcaster = rBroadcaster)
 
         ## Generate subclass objects for each type
         self.TASK_SUBCLASSES: dict = {
-            "core" : (self.BranchManager(rBroadcaster, CONSTANTS["CORE_RELATIVE_PATH"]), ),
-            "locale" : (self.BranchManager(rBroadcaster, CONSTANTS["LOCALE_RELATIVE_PATH"]), ),
-            "patcher" : (self.BranchManager(rBroadcaster, "", CONSTANTS["PATCHER_ABSOLUTE_FILES_PATH"]), ),
-            "all" : (self.BranchManager(rBroadcaster, CONSTANTS["CORE_RELATIVE_PATH"]), self.BranchManager(rBroadcaster, CONSTANTS["LOCALE_RELATIVE_PATH"]), self.BranchManager(rBroadcaster, "", CONSTANTS["PATCHER_ABSOLUTE_FILES_PATH"])),
+            "core" : (self.BranchManager(rBroadcaster, CONSTANTS["CORE_RELATIVE_PATH"], sName = "core"), ),
+            "locale" : (self.BranchManager(rBroadcaster, CONSTANTS["LOCALE_RELATIVE_PATH"], sName = "locale"), ),
+            "patcher" : (self.BranchManager(rBroadcaster, "", CONSTANTS["PATCHER_ABSOLUTE_FILES_PATH"], sName = "patcher"), ),
+            "all" : (self.BranchManager(rBroadcaster, CONSTANTS["CORE_RELATIVE_PATH"], sName = "core"), self.BranchManager(rBroadcaster, CONSTANTS["LOCALE_RELATIVE_PATH"], sName = "locale"), self.BranchManager(rBroadcaster, "", CONSTANTS["PATCHER_ABSOLUTE_FILES_PATH"], sName = "patcher")),
         }
 
     def __del__(self):
@@ -101,49 +224,69 @@ class BranchManagement(BaseTask):
         return True
 
     ## List existing branches
-    async def fetch_branch(self, sType: str, **kwargs) -> None:
+    async def fetch_branch(self, sType: str, **kwargs) -> str:
+        sBranches = ""
         if await self.check_arguments(sType):
-            for rClass in self.TASK_SUBCLASSES[sType.lower()]:
-                try:
-                    await rClass.list_branch(**kwargs)
-                except Exception:
-                    pass
+            lBranches = await self.__run_each(sType, lambda rClass: rClass.list_branch(**kwargs))
+            sBranches = self.__merge_values(sType, lBranches, ":\n")
 
-                self.lResults = rClass.lResults
-                return self.lResults[1]
+        return sBranches
 
     ## Change branch to provided by user
     async def change_branch(self, sType: str, sBranch: str, **kwargs) -> None:
         if await self.check_arguments(sType):
-            for rClass in self.TASK_SUBCLASSES[sType.lower()]:
-                try:
-                    await rClass.switch_branch(sBranch, **kwargs)
-                except Exception:
-                    pass
-
-                self.lResults = rClass.lResults
+            await self.__run_each(sType, lambda rClass: rClass.switch_branch(sBranch, **kwargs))
 
     ## Get running branch
-    async def get_current_branch(self, sType: str, **kwargs) -> None:
+    async def get_current_branch(self, sType: str, **kwargs) -> str:
         sBranch = ""
         if await self.check_arguments(sType):
-            for rClass in self.TASK_SUBCLASSES[sType.lower()]:
-                try:
-                    sBranch = await rClass.get_current_branch(**kwargs)
-                except Exception:
-                    pass
-
-                self.lResults = rClass.lResults
+            lBranches = await self.__run_each(sType, lambda rClass: rClass.get_current_branch(**kwargs))
+            sBranch = self.__merge_values(sType, [sValue.strip() for sValue in lBranches], ": ")
 
         return sBranch
 
+    ## Get commit sha of HEAD
+    async def get_head(self, sType: str, **kwargs) -> str:
+        sHead = ""
+        if await self.check_arguments(sType):
+            lHeads = await self.__run_each(sType, lambda rClass: rClass.get_head(**kwargs))
+            sHead = self.__merge_values(sType, lHeads, ": ")
+
+        return sHead
+
     ## Pull recent changes to repository
     async def update_repository(self, sType: str, **kwargs) -> None:
         if await self.check_arguments(sType):
-            for rClass in self.TASK_SUBCLASSES[sType.lower()]:
-                try:
-                    await rClass.update_repository(**kwargs)
-                except Exception:
-                    pass
-
-                self.lResults = rClass.lResults
+            await self.__run_each(sType, lambda rClass: rClass.update_repository(**kwargs))
+
+    ## Every repository of the type works in its own directory, so they can all go at once
+    async def __run_each(self, sType: str, fnCall) -> list:
+        lClasses = self.TASK_SUBCLASSES[sType.lower()]
+
+        async def run_one(rClass):
+            try:
+                return await fnCall(rClass)
+            except Exception:
+                return ""
+
+        lValues = await asyncio.gather(*(run_one(rClass) for rClass in lClasses))
+        self.lResults = self.__merge_results(lClasses)
+        return [sValue if sValue is not None else "" for sValue in lValues]
+
+    def __merge_results(self, lClasses: tuple) -> list:
+        if len(lClasses) == 1:
+            return lClasses[0].lResults
+
+        ## First failure decides the code, outputs are labeled by repository
+        iCode = next((rClass.lResults[0] for rClass in lClasses if rClass.lResults[0] != 0), 0)
+        sStdout = "\n".join(f"{rClass.sName}: {str(rClass.lResults[1]).strip()}" for rClass in lClasses)
+        sStderr = "\n".join(f"{rClass.sName}: {str(rClass.lResults[2]).strip()}" for rClass in lClasses if rClass.lResults[0] != 0)
+        return [iCode, sStdout, sStderr]
+
+    def __merge_values(self, sType: str, lValues: list[str], sSeparator: str) -> str:
+        lClasses = self.TASK_SUBCLASSES[sType.lower()]
+        if len(lClasses) == 1:
+            return lValues[0]
+
+        return "\n".join(f"*{rClass.sName}*{sSeparator}{sValue}" for rClass, sValue in zip(lClasses, lValues))
@@ -1,26 +1,143 @@
 import os
 import json
+import time
+from email.utils import parsedate_to_datetime
 
 from dotenv import load_dotenv
-from tornado.httpclient import AsyncHTTPClient
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.ioloop import IOLoop
+from tornado.queues import Queue, QueueEmpty
+from .utils import log
 
 ## Load .env
 load_dotenv()
 
+## Prefer curl backend (real keep-alive), fall back to tornado's simple client
+try:
+    from tornado.curl_httpclient import CurlAsyncHTTPClient as HttpClientClass
+except ImportError:
+    HttpClientClass = AsyncHTTPClient
+
 class Broadcaster:
+
+    COALESCE_WINDOW: float = float(os.getenv("BROADCAST_WINDOW", "0.5"))
+    QUEUE_SIZE: int = int(os.getenv("BROADCAST_QUEUE_SIZE", "500"))
+    MAX_RETRIES: int = int(os.getenv("BROADCAST_MAX_RETRIES", "5"))
+    MAX_BACKOFF: float = 30.0
+    MAX_MESSAGE_LENGTH: int = 35000 ## Slack truncates anything above 40k chars
+
     def __init__(self):
-        pass
+        self.hHttpClient = None
+        self.qMessages = Queue(maxsize=self.QUEUE_SIZE)
+        self.bSenderRunning = False
 
     def __del__(self):
-        pass
+        if self.hHttpClient:
+            self.hHttpClient.close()
+
+    def get_client(self) -> AsyncHTTPClient:
+        ## One long-lived client for the whole app, connections are reused between posts
+        if self.hHttpClient is None:
+            self.hHttpClient = HttpClientClass(force_instance=True)
+
+        return self.hHttpClient
 
     async def send(self, sTxt: str) -> None:
-        http_client = AsyncHTTPClient()
+        ## Producers only enqueue, sender coroutine does the slack part
+        ## Put blocks only when queue is full, so slack can't eat all the memory
+        self.start()
+        await self.qMessages.put(str(sTxt))
+
+    async def flush(self) -> None:
+        ## Wait until everything queued so far is delivered (or dropped)
+        self.start()
+        await self.qMessages.join()
+
+    def start(self) -> None:
+        if not self.bSenderRunning:
+            self.bSenderRunning = True
+            IOLoop.current().spawn_callback(self.__sender)
+
+    async def __sender(self) -> None:
+        ## Single consumer keeps messages in the order they were queued
+        while True:
+            lMessages = [await self.qMessages.get()]
+            try:
+                ## Give producers a moment and pack whatever came in meantime
+                await gen.sleep(self.COALESCE_WINDOW)
+                while True:
+                    try:
+                        lMessages.append(self.qMessages.get_nowait())
+                    except QueueEmpty:
+                        break
+
+                for sBatch in self.__pack(lMessages):
+                    await self.__post(sBatch)
+            except Exception as e:
+                ## Sender must survive anything, otherwise flush and send would hang forever
+                log(f"Dropping {len(lMessages)} slack messages: {e}", "error")
+            finally:
+                for _ in lMessages:
+                    self.qMessages.task_done()
+
+    def __pack(self, lMessages: list[str]) -> list[str]:
+        ## Glue messages together without crossing slack's limit
+        lBatches = []
+        sBatch = ""
+        for sTxt in lMessages:
+            if len(sBatch) > 0 and len(sBatch) + len(sTxt) + 1 > self.MAX_MESSAGE_LENGTH:
+                lBatches.append(sBatch)
+                sBatch = ""
+
+            sBatch = sTxt if len(sBatch) == 0 else f"{sBatch}\n{sTxt}"
+
+        if len(sBatch) > 0:
+            lBatches.append(sBatch)
+
+        return lBatches
+
+    async def __post(self, sTxt: str) -> None:
         ## Send message to slack's hook with appropriate header and json encoding
-        await http_client.fetch(os.getenv("HOOK_URL"), lambda response: None, method="POST", headers={"Content-Type" : 'application/json'}, body=json.dumps({"text" : sTxt}))
-        http_client.close()
+        fBackoff = 1.0
+        for iTry in range(self.MAX_RETRIES + 1):
+            try:
+                await self.get_client().fetch(os.getenv("HOOK_URL"), method="POST", headers={"Content-Type" : 'application/json'}, body=json.dumps({"text" : sTxt}))
+                return
+            except HTTPClientError as e:
+                ## Slack throttles us, respect Retry-After if it was given
+                if e.code == 429 and e.response is not None:
+                    fDelay = self.__get_retry_after(e.response.headers.get("Retry-After"), fBackoff)
+                elif e.code >= 500:
+                    fDelay = fBackoff
+                else:
+                    log(f"Slack refused message with code {e.code}: {e}", "error")
+                    return
+            except Exception as e:
+                fDelay = fBackoff
+                log(f"Couldn't deliver message to slack: {e}", "warning")
+
+            if iTry < self.MAX_RETRIES:
+                await gen.sleep(min(fDelay, self.MAX_BACKOFF))
+                fBackoff = min(fBackoff * 2, self.MAX_BACKOFF)
+
+        log(f"Dropping slack message after {self.MAX_RETRIES} retries", "error")
+
+    def __get_retry_after(self, sRetryAfter: str | None, fDefault: float) -> float:
+        ## Header may hold seconds or an http date, anything we can't read means our own backoff
+        if not sRetryAfter:
+            return fDefault
+
+        try:
+            return max(0.0, float(sRetryAfter))
+        except ValueError:
+            pass
+
+        try:
+            return max(0.0, parsedate_to_datetime(sRetryAfter).timestamp() - time.time())
+        except (TypeError, ValueError, IndexError):
+            return fDefault
 
 
 ## Singleton class for broadcaster
 Broadcaster_Singleton = Broadcaster()
-
@@ -0,0 +1,222 @@
+import os
+import re
+import stat
+from contextvars import ContextVar
+
+class GitRefReader:
+    ## Reads refs straight from .git, no fork needed for read-only branch queries
+    ## Every method returns None when it can't tell, callers should ask git itself then
+
+    SHA_PATTERN = re.compile(r"^[0-9a-f]{40}([0-9a-f]{24})?$")
+    MAX_SYMREF_DEPTH: int = 5
+
+    def __init__(self):
+        self.dFiles: dict[str, tuple] = {} ## path -> (stat key, content)
+        self.dPackedRefs: dict[str, tuple] = {} ## path -> (stat key, refs)
+
+    def get_current_branch(self, sDirectory: str) -> str | None:
+        lGitDirs = self.find_git_dirs(sDirectory)
+        if not lGitDirs:
+            return None
+
+        sHead = self.__read_file(os.path.join(lGitDirs[0], "HEAD"))
+        if sHead is None:
+            return None
+
+        if not sHead.startswith("ref: "):
+            ## Detached HEAD, git branch --show-current prints nothing as well
+            return "" if self.SHA_PATTERN.match(sHead) else None
+
+        sRef = sHead[5:].strip()
+        if not sRef.startswith("refs/heads/") or sRef == "refs/heads/.invalid":
+            return None ## Reftable or something else we don't understand
+
+        return sRef[len("refs/heads/"):]
+
+    def get_head(self, sDirectory: str) -> str | None:
+        lGitDirs = self.find_git_dirs(sDirectory)
+        if not lGitDirs:
+            return None
+
+        sValue = self.__read_file(os.path.join(lGitDirs[0], "HEAD"))
+        for _ in range(self.MAX_SYMREF_DEPTH):
+            if sValue is None:
+                return None
+
+            if not sValue.startswith("ref: "):
+                return sValue if self.SHA_PATTERN.match(sValue) else None
+
+            sValue = self.__resolve_ref(lGitDirs, sValue[5:].strip())
+
+        return None
+
+    def list_remote_branches(self, sDirectory: str) -> list[str] | None:
+        ## Names as git branch -r gives them (remote/branch), symbolic remote HEADs are left out
+        lGitDirs = self.find_git_dirs(sDirectory)
+        if not lGitDirs:
+            return None
+
+        sCommonDir = lGitDirs[-1]
+        dPacked = self.__read_packed_refs(sCommonDir)
+        if dPacked is None:
+            return None
+
+        lBranches = [sRef[len("refs/remotes/"):] for sRef in dPacked if sRef.startswith("refs/remotes/")]
+        sRemotesDir = os.path.join(sCommonDir, "refs", "remotes")
+        for sRoot, _, lFiles in os.walk(sRemotesDir):
+            for sFile in lFiles:
+                if not sFile.endswith(".lock"):
+                    lBranches.append(os.path.relpath(os.path.join(sRoot, sFile), sRemotesDir).replace(os.sep, "/"))
+
+        return sorted({sBranch for sBranch in lBranches if not sBranch.endswith("/HEAD")})
+
+    def find_git_dirs(self, sDirectory: str) -> list[str] | None:
+        ## Returns [git dir, common dir], both are the same unless it's a linked worktree
+        sCurrent = os.path.abspath(sDirectory)
+        if not os.path.isdir(sCurrent):
+            return None
+
+        while True:
+            sDotGit = os.path.join(sCurrent, ".git")
+            if os.path.isdir(sDotGit):
+                sGitDir = sDotGit
+                break
+
+            if os.path.isfile(sDotGit):
+                ## Worktrees and submodules point to their git dir
+                sLink = self.__read_file(sDotGit)
+                if sLink is None or not sLink.startswith("gitdir: "):
+                    return None
+
+                sGitDir = os.path.normpath(os.path.join(sCurrent, sLink[8:].strip()))
+                break
+
+            sParent = os.path.dirname(sCurrent)
+            if sParent == sCurrent:
+                return None
+
+            sCurrent = sParent
+
+        sCommonDir = self.__read_file(os.path.join(sGitDir, "commondir"))
+        sCommonDir = sGitDir if sCommonDir is None else os.path.normpath(os.path.join(sGitDir, sCommonDir))
+
+        ## Reftable keeps refs in binary tables, leave those to git
+        if os.path.isdir(os.path.join(sCommonDir, "reftable")):
+            return None
+
+        return [sGitDir, sCommonDir]
+
+    def __resolve_ref(self, lGitDirs: list[str], sRef: str) -> str | None:
+        ## Per worktree refs live in git dir, shared ones in common dir, loose ref wins over packed
+        for sGitDir in dict.fromkeys(lGitDirs):
+            sValue = self.__read_file(os.path.join(sGitDir, *sRef.split("/")))
+            if sValue is not None:
+                return sValue
+
+        dPacked = self.__read_packed_refs(lGitDirs[-1])
+        if dPacked is None:
+            return None
+
+        return dPacked.get(sRef)
+
+    def __read_packed_refs(self, sCommonDir: str) -> dict | None:
+        sPath = os.path.join(sCommonDir, "packed-refs")
+        tKey = self.__get_stat_key(sPath)
+        if tKey is None:
+            return {} if os.path.isdir(os.path.join(sCommonDir, "refs")) else None
+
+        rCached = self.dPackedRefs.get(sPath)
+        if rCached and rCached[0] == tKey:
+            return rCached[1]
+
+        dRefs = {}
+        try:
+            with open(sPath, "r", encoding="utf-8") as hFile:
+                for sLine in hFile:
+                    ## Skip header and peeled tag lines
+                    if sLine.startswith("#") or sLine.startswith("^"):
+                        continue
+
+                    lParts = sLine.split()
+                    if len(lParts) == 2:
+                        dRefs[lParts[1]] = lParts[0]
+        except (OSError, UnicodeDecodeError):
+            return None
+
+        self.dPackedRefs[sPath] = (tKey, dRefs)
+        return dRefs
+
+    def __read_file(self, sPath: str) -> str | None:
+        ## Content is reused until file gets rewritten, git always replaces ref files by rename
+        tKey = self.__get_stat_key(sPath)
+        if tKey is None:
+            return None
+
+        rCached = self.dFiles.get(sPath)
+        if rCached and rCached[0] == tKey:
+            return rCached[1]
+
+        try:
+            with open(sPath, "r", encoding="utf-8") as hFile:
+                sContent = hFile.read().strip()
+        except (OSError, UnicodeDecodeError):
+            return None
+
+        self.dFiles[sPath] = (tKey, sContent)
+        return sContent
+
+    def __get_stat_key(self, sPath: str) -> tuple | None:
+        try:
+            rStat = os.stat(sPath)
+        except OSError:
+            return None
+
+        if not stat.S_ISREG(rStat.st_mode):
+            return None
+
+        return (rStat.st_ino, rStat.st_mtime_ns, rStat.st_size)
+
+class GitStateCache:
+    ## What current request already knows about its repositories, keyed by directory
+    ## Request holds its repositories for write, so nobody else can make this stale meanwhile
+
+    BRANCH: str = "branch"
+    HEAD: str = "head"
+    PULLED: str = "pulled"
+
+    def __init__(self):
+        self.vState: ContextVar = ContextVar("git_state", default=None)
+
+    def activate(self):
+        return self.vState.set({})
+
+    def deactivate(self, hToken) -> None:
+        self.vState.reset(hToken)
+
+    def get(self, sDirectory: str, sKey: str):
+        dState = self.vState.get()
+        if dState is None:
+            return None
+
+        return dState.get(sDirectory, {}).get(sKey)
+
+    def set(self, sDirectory: str, sKey: str, rValue) -> None:
+        ## Outside of request there is nothing to remember
+        dState = self.vState.get()
+        if dState is not None:
+            dState.setdefault(sDirectory, {})[sKey] = rValue
+
+    def forget(self, sDirectory: str, *lKeys: str) -> None:
+        dState = self.vState.get()
+        if dState is None or not sDirectory in dState:
+            return
+
+        for sKey in (lKeys or list(dState[sDirectory])):
+            dState[sDirectory].pop(sKey, None)
+
+
+## Singleton class for git ref reader
+GitRefReader_Singleton = GitRefReader()
+
+## Singleton class for request's git state
+GitStateCache_Singleton = GitStateCache()
@@ -0,0 +1,123 @@
+import os
+import time
+import asyncio
+import itertools
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+
+class Job:
+
+    RUNNING: str = "RUNNING"
+    DONE: str = "DONE"
+    FAILED: str = "FAILED"
+
+    RESULT_PREVIEW: int = 2000 ## Keep registry small, full outputs are in spool files
+    PHASE_LIMIT: int = 100 ## Oldest phases are dropped past this
+
+    def __init__(self, iId: int, sHandler: str, sArguments: str):
+        self.iId = iId
+        self.sHandler = sHandler
+        self.sArguments = sArguments
+        self.sState = self.RUNNING
+        self.sStep = ""
+        self.ttStart = time.time()
+        self.ttEnd = 0.0
+        self.dOpenSteps: dict = {} ## owner -> (step, start), parallel tasks time their own steps
+        self.lPhases = deque(maxlen=self.PHASE_LIMIT)
+        self.lResults = [-1, "NOT SET", "NOT SET"]
+        self.eFinished = asyncio.Event()
+
+    def set_step(self, sStep: str, hOwner = None) -> None:
+        ## Only owner's previous step is closed, steps of other tasks keep running
+        self.end_step(hOwner)
+        self.dOpenSteps[hOwner] = (sStep, time.time())
+        self.sStep = sStep
+
+    def end_step(self, hOwner = None) -> None:
+        if not hOwner in self.dOpenSteps:
+            return
+
+        sStep, ttStepStart = self.dOpenSteps.pop(hOwner)
+        self.lPhases.append((sStep, time.time() - ttStepStart))
+
+        ## Show whatever is still going on, latest first
+        self.sStep = next(reversed(self.dOpenSteps.values()))[0] if len(self.dOpenSteps) > 0 else ""
+
+    def set_results(self, lResults: list) -> None:
+        self.lResults = [lResults[0], str(lResults[1])[-self.RESULT_PREVIEW:], str(lResults[2])[-self.RESULT_PREVIEW:]]
+
+    def finish(self, bSuccess: bool) -> None:
+        for hOwner in list(self.dOpenSteps):
+            self.end_step(hOwner)
+
+        self.sState = self.DONE if bSuccess else self.FAILED
+        self.ttEnd = time.time()
+        self.eFinished.set()
+
+    async def wait(self) -> None:
+        await self.eFinished.wait()
+
+    def get_elapsed(self) -> float:
+        return (self.ttEnd if self.ttEnd > 0 else time.time()) - self.ttStart
+
+    def to_dict(self) -> dict:
+        return {
+            "id" : self.iId,
+            "handler" : self.sHandler,
+            "arguments" : self.sArguments,
+            "state" : self.sState,
+            "step" : self.sStep,
+            "started" : self.ttStart,
+            "elapsed" : round(self.get_elapsed(), 2),
+            "phases" : [{"step" : sStep, "elapsed" : round(fElapsed, 2)} for sStep, fElapsed in self.lPhases],
+            "results" : self.lResults,
+        }
+
+class JobRegistry:
+
+    HISTORY_SIZE: int = int(os.getenv("JOB_HISTORY_SIZE", "20"))
+
+    def __init__(self):
+        self.dJobs: OrderedDict[int, Job] = OrderedDict()
+        self.iCounter = itertools.count(1)
+        self.vCurrentJob: ContextVar = ContextVar("current_job", default=None)
+
+    def normalize_arguments(self, sArguments: str) -> str:
+        return " ".join(sArguments.split())
+
+    def create(self, sHandler: str, sArguments: str) -> Job:
+        rJob = Job(next(self.iCounter), sHandler, self.normalize_arguments(sArguments))
+        self.dJobs[rJob.iId] = rJob
+        self.__trim()
+        return rJob
+
+    ## Job is tracked by context, so tasks don't need it passed around
+    def activate(self, rJob: Job):
+        return self.vCurrentJob.set(rJob)
+
+    def deactivate(self, hToken) -> None:
+        self.vCurrentJob.reset(hToken)
+
+    def get_current(self) -> Job | None:
+        return self.vCurrentJob.get()
+
+    def get_jobs(self) -> list[Job]:
+        return list(self.dJobs.values())
+
+    def get_running(self) -> list[Job]:
+        return [rJob for rJob in self.dJobs.values() if rJob.sState == Job.RUNNING]
+
+    def find_running(self, sHandler: str, sArguments: str) -> Job | None:
+        ## Same handler with same arguments means the very same operation
+        sArguments = self.normalize_arguments(sArguments)
+        return next((rJob for rJob in self.get_running() if rJob.sHandler == sHandler and rJob.sArguments == sArguments), None)
+
+    def __trim(self) -> None:
+        ## Forget oldest finished jobs, running ones always stay
+        lFinished = [iId for iId, rJob in self.dJobs.items() if rJob.sState != Job.RUNNING]
+        for iId in lFinished[:max(0, len(self.dJobs) - self.HISTORY_SIZE)]:
+            del self.dJobs[iId]
+
+
+## Singleton class for job registry
+JobRegistry_Singleton = JobRegistry()
@@ -18,6 +18,10 @@ from .branch import BranchManagement
 from .server import ServerManagement
 from .patcher import PatcherClientManagement, PatcherServerManagement
 from .api import GameStatusChecker, GameReloader
+from .scheduler import Scheduler_Singleton
+from .jobs import JobRegistry_Singleton
+from .gitrefs import GitStateCache_Singleton
+from .monitor import HealthMonitor_Singleton
 from .utils import encrypt, decrypt, CONSTANTS, log, get_remote_host
 
 load_dotenv()
@@ -26,6 +30,7 @@ enable_pretty_logging()
 class BaseHandler(tornado.web.RequestHandler):
     def initialize(self) -> None:
         self.bCanProcess = True
+        self.bFailed = False
         self.sReturnPost = "Got your request! I'm processing it, give me a moment.."
 
     def prepare(self) -> None:
@@ -82,16 +87,49 @@ class BaseHandler(tornado.web.RequestHandler):
 
         if self.__check_status():
             ## Ok, buffer flushed, sleep done, now process command
-            await self.process_request(self.get_argument("text", "", True))
+            ## Every request is tracked as a job until it's done
+            sArguments = self.get_argument("text", "", True)
+
+            ## Identical request is already on its way, ride along instead of doing it twice
+            rRunning = JobRegistry_Singleton.find_running(self.request.path, sArguments)
+            if rRunning:
+                await self.attach_to_job(rRunning)
+                return
+
+            rJob = JobRegistry_Singleton.create(self.request.path, sArguments)
+            hToken = JobRegistry_Singleton.activate(rJob)
+            hGitToken = GitStateCache_Singleton.activate()
+            try:
+                await self.process_request(sArguments)
+            finally:
+                rJob.finish(not self.bFailed and rJob.lResults[0] in (0, -1))
+                GitStateCache_Singleton.deactivate(hGitToken)
+                JobRegistry_Singleton.deactivate(hToken)
+
             await Broadcaster_Singleton.send("Did what I could. Tony out.")
+            await Broadcaster_Singleton.flush()
+
+    async def attach_to_job(self, rJob) -> None:
+        await Broadcaster_Singleton.send(f"Same request is already running as job #{rJob.iId}, I'll let you know how it ends..")
+        await rJob.wait()
+
+        ## Everything job said went to the same channel, just point at its outcome
+        sOutcome = "finished successfully" if rJob.sState == rJob.DONE else "failed"
+        await Broadcaster_Singleton.send(f"Job #{rJob.iId} you were waiting for {sOutcome} after {rJob.get_elapsed():.1f}s. Tony out.")
+        await Broadcaster_Singleton.flush()
 
     def process_error(self, sFuncName: str, rException: Exception) -> None:
+        self.bFailed = True
         log(f"Following error occured for function: {sFuncName}:", "error")
         log(f"{type(rException).__name__}: {str(rException)}", "error")
 
     def __check_status(self):
         return self.bCanProcess
 
+    ## Hold named resources for the duration of an operation, conflicting requests wait in queue
+    def reserve(self, lWrite: tuple[str] = (), lRead: tuple[str] = ()):
+        return Scheduler_Singleton.reserve(lWrite, lRead, Broadcaster_Singleton)
+
     async def unknown_command(self):
         await Broadcaster_Singleton.send("I cannot perform any sort of this action. Double check your command mate!")
 
@@ -99,6 +137,39 @@ class HomeHandler(BaseHandler):
     async def get(self):
         self.write(json.dumps({"text" : "Your reached the place where devil says good night"}))
 
+class JobsHandler(tornado.web.RequestHandler):
+
+    LOCAL_HOSTS: tuple[str] = ("127.0.0.1", "::1")
+
+    def prepare(self) -> None:
+        ## Jobs carry command outputs, keep them for local eyes only
+        if not self.__is_local():
+            log(f"Jobs request came from host {get_remote_host(self.request)}. Dropping.", "warning")
+            self.request.connection.close()
+            self.finish()
+
+    def __is_local(self) -> bool:
+        ## Connection itself has to be local, headers alone are whatever client wants them to be
+        if not self.request.remote_ip in self.LOCAL_HOSTS:
+            return False
+
+        ## Local proxy (nginx) tells who is really asking, it sets X-Real-IP and appends to X-Forwarded-For
+        sRealIp = self.request.headers.get("X-Real-IP")
+        if sRealIp is not None and not sRealIp.strip() in self.LOCAL_HOSTS:
+            return False
+
+        sForwardedFor = self.request.headers.get("X-Forwarded-For")
+        if sForwardedFor is not None and not sForwardedFor.split(",")[-1].strip() in self.LOCAL_HOSTS:
+            return False
+
+        return True
+
+    def set_default_headers(self) -> None:
+        self.set_header("Content-Type", 'application/json')
+
+    async def get(self):
+        self.write(json.dumps({"jobs" : [rJob.to_dict() for rJob in JobRegistry_Singleton.get_jobs()]}))
+
 class BranchHandler(BaseHandler):
     async def process_request(self, sArguments: str):
         log(f"[Branch Handler] A request came from {get_remote_host(self.request)} following arguments: {sArguments}", "info")
@@ -120,21 +191,35 @@ class BranchHandler(BaseHandler):
             await self.unknown_command()
 
     async def switch_branch(self, sType: str, sBranch: str):
+        lWrite = Scheduler_Singleton.get_repository_resources(sType)
+        bCore = Scheduler_Singleton.CORE in lWrite
         try:
-            branchEvent = BranchManagement(Broadcaster_Singleton)
-            await branchEvent.change_branch(sType, sBranch)
+            async with self.reserve(lWrite = lWrite + ((Scheduler_Singleton.GAME, ) if bCore else ())):
+                branchEvent = BranchManagement(Broadcaster_Singleton)
+                await branchEvent.change_branch(sType, sBranch)
+                bSwitched = branchEvent.check_results()
+
+                ## Core commit might have been built already, bring it back right away
+                if bSwitched and bCore:
+                    sHead = await branchEvent.get_head("CORE", bSilentCall = True)
+                    serverEvent = ServerManagement(Broadcaster_Singleton)
+                    if await serverEvent.restore_core(sHead):
+                        await Broadcaster_Singleton.send(f"Server is running stored build of {sHead[:10]}!")
+                    else:
+                        await Broadcaster_Singleton.send("No usable build for this commit, use `/server core rebuild` to compile it.")
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
 
-        if branchEvent.check_results():
+        if bSwitched:
             await Broadcaster_Singleton.send(f"Running branch was switched to {sBranch}!")
 
     async def get_current_branch(self, sType: str):
         sBranch = ""
         try:
-            branchEvent = BranchManagement(Broadcaster_Singleton)
-            sBranch = await branchEvent.get_current_branch(sType)
+            async with self.reserve(lRead = Scheduler_Singleton.get_repository_resources(sType)):
+                branchEvent = BranchManagement(Broadcaster_Singleton)
+                sBranch = await branchEvent.get_current_branch(sType)
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
@@ -145,8 +230,10 @@ class BranchHandler(BaseHandler):
     async def list_branches(self, sType: str = "ALL"):
         sBranches = ""
         try:
-            branchEvent = BranchManagement(Broadcaster_Singleton)
-            sBranches = await branchEvent.fetch_branch(sType)
+            ## Listing pulls first, so it writes to repo
+            async with self.reserve(lWrite = Scheduler_Singleton.get_repository_resources(sType)):
+                branchEvent = BranchManagement(Broadcaster_Singleton)
+                sBranches = await branchEvent.fetch_branch(sType)
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
@@ -157,17 +244,24 @@ class BranchHandler(BaseHandler):
     async def update_repository(self, sType: str = "ALL"):
         sCurBranch = ""
         try:
-            branchEvent = BranchManagement(Broadcaster_Singleton)
-            sCurBranch = await branchEvent.get_current_branch(sType)
-            await branchEvent.update_repository(sType)
+            async with self.reserve(lWrite = Scheduler_Singleton.get_repository_resources(sType)):
+                branchEvent = BranchManagement(Broadcaster_Singleton)
+                sCurBranch = await branchEvent.get_current_branch(sType)
+                await branchEvent.update_repository(sType)
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
 
         if branchEvent.check_results():
-            await Broadcaster_Singleton.send(f"Branch {sCurBranch.strip()} was updated!")
+            if sType.lower() == "all":
+                await Broadcaster_Singleton.send(f"Repositories were updated! Running branches:\n{sCurBranch}")
+            else:
+                await Broadcaster_Singleton.send(f"Branch {sCurBranch.strip()} was updated!")
 
 class ServerHandler(BaseHandler):
+
+    JOB_PHASES_SHOWN: int = 5
+
     def data_received(self, chunk: bytes) -> Awaitable[None] | None:
         return super().data_received(chunk)
 
@@ -180,66 +274,87 @@ class ServerHandler(BaseHandler):
 
         if len(lArguments) >= 2 and lArguments[1] == "rebuild":
             if lArguments[0] == "core":
-                await self.rebuild_core(lArguments[0])
+                await self.rebuild_core(lArguments[0], bForce = len(lArguments) >= 3 and lArguments[2] == "force")
             elif lArguments[0] == "quest":
-                await self.rebuild_quest(lArguments[0])
+                await self.rebuild_quest(lArguments[0], bForce = len(lArguments) >= 3 and lArguments[2] == "force")
         elif lArguments[0] == "reload" and len(lArguments) >= 2:
             await self.reload_game(lArguments[1])
         elif lArguments[0] == "start":
             await self.start_game()
         elif lArguments[0] == "stop":
             await self.stop_game()
+        elif lArguments[0] == "restart" and len(lArguments) >= 2 and lArguments[1] == "rolling":
+            await self.rolling_restart(int(lArguments[2]) if len(lArguments) >= 3 and lArguments[2].isdigit() else 0)
         elif lArguments[0] == "restart":
             await self.restart_game()
         elif lArguments[0] == "update":
             await self.update_server()
         elif lArguments[0] == "status":
             await self.check_status()
+        elif lArguments[0] == "jobs":
+            await self.list_jobs()
         else:
             await self.unknown_command()
 
-    async def rebuild_core(self, sType: str):
+    async def rebuild_core(self, sType: str, bForce: bool = False):
         sCurBranch = ""
+        bRebuilt = False
         try:
-            branchEvent = BranchManagement(Broadcaster_Singleton)
-            sCurBranch = await branchEvent.get_current_branch(sType)
+            async with self.reserve(lWrite = (Scheduler_Singleton.CORE, Scheduler_Singleton.GAME)):
+                branchEvent = BranchManagement(Broadcaster_Singleton)
+                sCurBranch = await branchEvent.get_current_branch(sType)
 
-            serverEvent = ServerManagement(Broadcaster_Singleton)
-            await serverEvent.rebuild_core()
+                serverEvent = ServerManagement(Broadcaster_Singleton)
+                bRebuilt = await serverEvent.rebuild_core(bForce)
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
 
-        await Broadcaster_Singleton.send(f"Core was rebuilt! Running branch: {sCurBranch.strip()}")
+        if bRebuilt:
+            await Broadcaster_Singleton.send(f"Core was rebuilt! Running branch: {sCurBranch.strip()}")
+        else:
+            await Broadcaster_Singleton.send(f"Core is up to date! Running branch: {sCurBranch.strip()}")
 
-    async def rebuild_quest(self, sType: str):
+    async def rebuild_quest(self, sType: str, bForce: bool = False):
         sCurBranch = ""
         try:
-            branchEvent = BranchManagement(Broadcaster_Singleton)
-            sCurBranch = await branchEvent.get_current_branch("LOCALE")
-
-            serverEvent = ServerManagement(Broadcaster_Singleton)
-            await serverEvent.rebuild_quest()
+            async with self.reserve(lWrite = (Scheduler_Singleton.LOCALE, Scheduler_Singleton.QUEST)):
+                sCurBranch = await self.__rebuild_quest(bForce)
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
 
         await Broadcaster_Singleton.send(f"Quest was rebuilt! Running branch: {sCurBranch.strip()}")
 
+    ## Caller has to hold LOCALE and QUEST
+    async def __rebuild_quest(self, bForce: bool = False) -> str:
+        branchEvent = BranchManagement(Broadcaster_Singleton)
+        sCurBranch = await branchEvent.get_current_branch("LOCALE")
+
+        serverEvent = ServerManagement(Broadcaster_Singleton)
+        await serverEvent.rebuild_quest(bForce)
+        return sCurBranch
+
     async def start_game(self):
+        bReady = False
         try:
-            serverEvent = ServerManagement(Broadcaster_Singleton)
-            await serverEvent.start_game()
+            async with self.reserve(lWrite = (Scheduler_Singleton.GAME, )):
+                serverEvent = ServerManagement(Broadcaster_Singleton)
+                bReady = await serverEvent.start_game()
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
 
-        await Broadcaster_Singleton.send("Server was started!")
+        if bReady:
+            await Broadcaster_Singleton.send("Server was started!")
+        else:
+            await Broadcaster_Singleton.send("Server was started, but not every channel is up!")
 
     async def stop_game(self):
         try:
-            serverEvent = ServerManagement(Broadcaster_Singleton)
-            await serverEvent.stop_game()
+            async with self.reserve(lWrite = (Scheduler_Singleton.GAME, )):
+                serverEvent = ServerManagement(Broadcaster_Singleton)
+                await serverEvent.stop_game()
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
@@ -248,18 +363,33 @@ class ServerHandler(BaseHandler):
 
     async def restart_game(self):
         try:
-            serverEvent = ServerManagement(Broadcaster_Singleton)
-            await serverEvent.restart_game()
+            async with self.reserve(lWrite = (Scheduler_Singleton.GAME, )):
+                serverEvent = ServerManagement(Broadcaster_Singleton)
+                await serverEvent.restart_game()
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
 
         await Broadcaster_Singleton.send("Server was restarted!")
 
+    async def rolling_restart(self, iBatch: int):
+        bRestarted = False
+        try:
+            async with self.reserve(lWrite = (Scheduler_Singleton.GAME, )):
+                serverEvent = ServerManagement(Broadcaster_Singleton)
+                bRestarted = await serverEvent.rolling_restart(iBatch)
+        except Exception as e:
+            self.process_error(sys._getframe().f_code.co_name, e)
+            return
+
+        if bRestarted:
+            await Broadcaster_Singleton.send("Server was restarted channel by channel!")
+
     async def update_server(self):
         try:
-            serverEvent = ServerManagement(Broadcaster_Singleton)
-            await serverEvent.update_server()
+            async with self.reserve(lWrite = (Scheduler_Singleton.LOCALE, )):
+                serverEvent = ServerManagement(Broadcaster_Singleton)
+                await serverEvent.update_server()
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
@@ -267,26 +397,53 @@ class ServerHandler(BaseHandler):
         await Broadcaster_Singleton.send("Server was updated!")
 
     async def check_status(self):
+        ## Monitor keeps channels sampled in background, no need to probe them again
+        if HealthMonitor_Singleton.is_ready():
+            await Broadcaster_Singleton.send(HealthMonitor_Singleton.get_report())
+            return
+
         try:
-            serverEvent = GameStatusChecker(Broadcaster_Singleton)
-            await serverEvent.check_channels_status()
+            async with self.reserve(lRead = (Scheduler_Singleton.GAME, )):
+                serverEvent = GameStatusChecker(Broadcaster_Singleton)
+                await serverEvent.check_channels_status()
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
 
-    async def reload_game(self, sType : str):
-        try:
-            ## First, update branch
-            branchEvent = BranchManagement(Broadcaster_Singleton)
-            sCurBranch = await branchEvent.get_current_branch(sType)
-            await branchEvent.update_repository(sType)
+    async def list_jobs(self):
+        rCurrent = JobRegistry_Singleton.get_current()
+        sReturnStr = ""
+        for rJob in JobRegistry_Singleton.get_jobs():
+            if rJob is rCurrent:
+                continue
 
-            ## Then, rebuild quest
-            await self.rebuild_quest("")
+            sStep = f", step: {rJob.sStep}" if len(rJob.sStep) > 0 else ""
+            sReturnStr += f"#{rJob.iId} `{rJob.sHandler} {rJob.sArguments}` *{rJob.sState}* {rJob.get_elapsed():.0f}s{sStep}\n"
+            ## Only latest phases, whole history is at GET /jobs
+            lPhases = list(rJob.lPhases)
+            if len(lPhases) > self.JOB_PHASES_SHOWN:
+                sReturnStr += f"    ... {len(lPhases) - self.JOB_PHASES_SHOWN} earlier phases\n"
+            for sPhase, fElapsed in lPhases[-self.JOB_PHASES_SHOWN:]:
+                sReturnStr += f"    {sPhase} {fElapsed:.1f}s\n"
 
-            ## And now, reload game
-            serverEvent = GameReloader(Broadcaster_Singleton)
-            await serverEvent.reload_game(sType)
+        await Broadcaster_Singleton.send(sReturnStr if len(sReturnStr) > 0 else "No jobs were run lately.")
+
+    async def reload_game(self, sType : str):
+        try:
+            lWrite = Scheduler_Singleton.get_repository_resources(sType) + (Scheduler_Singleton.LOCALE, Scheduler_Singleton.QUEST)
+            async with self.reserve(lWrite = lWrite, lRead = (Scheduler_Singleton.GAME, )):
+                ## First, update branch
+                branchEvent = BranchManagement(Broadcaster_Singleton)
+                sCurBranch = await branchEvent.get_current_branch(sType)
+                await branchEvent.update_repository(sType)
+
+                ## Then, rebuild quest
+                sCurBranch = await self.__rebuild_quest()
+                await Broadcaster_Singleton.send(f"Quest was rebuilt! Running branch: {sCurBranch.strip()}")
+
+                ## And now, reload game
+                serverEvent = GameReloader(Broadcaster_Singleton)
+                await serverEvent.reload_game(sType)
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             return
@@ -406,7 +563,8 @@ class PatcherServerHandler(BaseHandler):
         patcherEvent = None
         try:
             patcherEvent = PatcherServerManagement(Broadcaster_Singleton)
-            await patcherEvent.send_branch()
+            async with self.reserve(lRead = (Scheduler_Singleton.PATCHER, )):
+                await patcherEvent.send_branch()
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             pass
@@ -422,10 +580,11 @@ class PatcherServerHandler(BaseHandler):
         try:
             patcherEvent = PatcherServerManagement(Broadcaster_Singleton)
             jsResponse = json.loads(self.request.body)
-            if jsResponse.get("type", "") == "switch":
-                await patcherEvent.switch_branch(jsResponse.get("branch", ""))
-            else:
-                await patcherEvent.update_repository()
+            async with self.reserve(lWrite = (Scheduler_Singleton.PATCHER, )):
+                if jsResponse.get("type", "") == "switch":
+                    await patcherEvent.switch_branch(jsResponse.get("branch", ""))
+                else:
+                    await patcherEvent.update_repository()
         except Exception as e:
             self.process_error(sys._getframe().f_code.co_name, e)
             pass
@@ -442,6 +601,7 @@ class Application(tornado.web.Application):
             (r"/server", ServerHandler),
             (r"/patcher", PatcherClientHandler),
             (r"/patcher_server", PatcherServerHandler),
+            (r"/jobs", JobsHandler),
         ]
 
         settings = {"title":"Tony", "debug":(os.getenv("DEBUG").lower() == "true"),
@@ -463,6 +623,9 @@ async def main():
     for rLogger in lTornadoLoggers:
         rLogger.addHandler(hLogger)
 
+    ## Keep an eye on channels from the start
+    HealthMonitor_Singleton.start()
+
     ## Assembly consumer and producer
     print("App PID: {os.getpid()}")
 
@@ -0,0 +1,106 @@
+import os
+import time
+import asyncio
+from collections import deque
+
+from tornado.ioloop import IOLoop
+from .api import GameStatusChecker
+from .broadcaster import Broadcaster_Singleton
+from .scheduler import Scheduler_Singleton
+from .utils import CONSTANTS, log
+
+class EndpointHealth:
+    def __init__(self, sName: str, iPortNum, iHistorySize: int):
+        self.sName = sName
+        self.iPortNum = iPortNum
+        self.sStatus = ""
+        self.fLatency = 0.0
+        self.ttChecked = 0.0
+        self.ttChanged = 0.0
+        self.lSamples = deque(maxlen=iHistorySize) ## (time, status, latency)
+        self.lTransitions = deque(maxlen=iHistorySize) ## (time, old status, new status)
+
+    def update(self, sStatus: str, fLatency: float) -> str:
+        ## Returns previous status if it has changed, empty string otherwise
+        ttNow = time.time()
+        sPrevious = self.sStatus
+        self.sStatus, self.fLatency, self.ttChecked = sStatus, fLatency, ttNow
+        self.lSamples.append((ttNow, sStatus, fLatency))
+        if sPrevious == sStatus:
+            return ""
+
+        self.ttChanged = ttNow
+        self.lTransitions.append((ttNow, sPrevious, sStatus))
+        return sPrevious
+
+class HealthMonitor:
+
+    CHECK_INTERVAL: float = float(os.getenv("HEALTH_CHECK_INTERVAL", "30")) ## 0 turns monitor off
+    HISTORY_SIZE: int = int(os.getenv("HEALTH_HISTORY_SIZE", "20"))
+    SEND_ALERTS: bool = os.getenv("HEALTH_ALERTS", "false").lower() == "true"
+
+    def __init__(self):
+        self.bRunning = False
+        self.dEndpoints: dict[str, EndpointHealth] = {}
+        lNames = CONSTANTS["GAME_PORTS_NAME"][:len(CONSTANTS["GAME_PORTS"])] + ["Auth"]
+        lPorts = CONSTANTS["GAME_PORTS"] + [CONSTANTS["GAME_AUTH_PORT"]]
+        for sName, iPortNum in zip(lNames, lPorts):
+            self.dEndpoints[sName] = EndpointHealth(sName, iPortNum, self.HISTORY_SIZE)
+
+    def is_enabled(self) -> bool:
+        return self.CHECK_INTERVAL > 0
+
+    def is_ready(self) -> bool:
+        ## Cache is good to answer only once every endpoint was sampled
+        return self.bRunning and all(rEndpoint.ttChecked > 0 for rEndpoint in self.dEndpoints.values())
+
+    def start(self) -> None:
+        if self.is_enabled() and not self.bRunning:
+            self.bRunning = True
+            IOLoop.current().spawn_callback(self.__monitor)
+
+    async def sample(self) -> None:
+        rChecker = GameStatusChecker(Broadcaster_Singleton)
+        lEndpoints = list(self.dEndpoints.values())
+        lResults = await asyncio.gather(*(rChecker.probe(rEndpoint.iPortNum) for rEndpoint in lEndpoints))
+
+        lDown = []
+        for rEndpoint, (sStatus, fLatency) in zip(lEndpoints, lResults):
+            sPrevious = rEndpoint.update(sStatus, fLatency)
+            if len(sPrevious) > 0:
+                log(f"{rEndpoint.sName} went from {sPrevious} to {sStatus}", "warning" if sStatus == "OFF" else "info")
+                if sStatus == "OFF":
+                    lDown.append(rEndpoint.sName)
+
+        ## Channels are expected to go down while somebody holds the game, no need to shout then
+        if self.SEND_ALERTS and len(lDown) > 0 and not Scheduler_Singleton.get_lock(Scheduler_Singleton.GAME).bWriter:
+            await Broadcaster_Singleton.send(f"Heads up! Following channels went down: *{', '.join(lDown)}*")
+
+    def get_report(self) -> str:
+        sReturnStr = ""
+        for rEndpoint in self.dEndpoints.values():
+            sLatency = f" ({rEndpoint.fLatency * 1000:.0f} ms)" if rEndpoint.sStatus == "ON" else ""
+            sReturnStr += f"{rEndpoint.sName} status: *{rEndpoint.sStatus}*{sLatency}, since {self.__format_age(rEndpoint.ttChanged)} ago\n"
+
+        ttChecked = min(rEndpoint.ttChecked for rEndpoint in self.dEndpoints.values())
+        return sReturnStr + f"Checked {self.__format_age(ttChecked)} ago"
+
+    async def __monitor(self) -> None:
+        while True:
+            try:
+                await self.sample()
+            except Exception as e:
+                log(f"Health check failed: {e}", "error")
+
+            await asyncio.sleep(self.CHECK_INTERVAL)
+
+    def __format_age(self, ttTime: float) -> str:
+        iSeconds = int(time.time() - ttTime)
+        if iSeconds < 60:
+            return f"{iSeconds}s"
+
+        return f"{iSeconds // 60}m {iSeconds % 60}s"
+
+
+## Singleton class for health monitor
+HealthMonitor_Singleton = HealthMonitor()
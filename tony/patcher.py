@@ -149,20 +149,17 @@ class PatcherServerManagement(BaseTask):
                 self.lResults = branchEvent.lResults
 
     def __generate_list(self) -> None:
-        ## Save current path
-        sCurDir = os.getcwd()
-
         ## Top node for xml
         xmlRoot = ET.Element("FileProfiler", {"FormatVersion" : "1"})
         xmlFileList = ET.SubElement(xmlRoot, "File_List")
 
-        ## Walk to patcher public directory
-        os.chdir(CONSTANTS["PATCHER_ABSOLUTE_FILES_PATH"])
-        for (root, _, files) in os.walk(".", topdown=True):
+        ## Walk patcher public directory, paths are kept relative to it
+        sBaseDir = CONSTANTS["PATCHER_ABSOLUTE_FILES_PATH"]
+        for (root, _, files) in os.walk(sBaseDir, topdown=True):
             ## Checking for excepted dirs
             bFound = False
             for sDir in self.EXCEPTION_DIRS:
-                if root.find(sDir) != -1:
+                if os.path.relpath(root, sBaseDir).find(sDir) != -1:
                     bFound = True
                     continue
 
@@ -181,17 +178,14 @@ class PatcherServerManagement(BaseTask):
                     continue
 
                 ## Generating nodes
-                ET.SubElement(xmlFileList, "File", {"FileName" : os.path.join(root, sFile)[2:],
+                ET.SubElement(xmlFileList, "File", {"FileName" : os.path.relpath(os.path.join(root, sFile), sBaseDir),
                                                     "FileSize" : str(os.path.getsize(os.path.join(root, sFile))),
                                                     "FileMD5" : self.__get_file_md5(os.path.join(root, sFile))})
 
         ## Saving xml
-        with open("index.xml", "w", encoding="utf-8") as hFile:
+        with open(os.path.join(sBaseDir, "index.xml"), "w", encoding="utf-8") as hFile:
             hFile.write(self.__prettify(xmlRoot))
 
-        ## Jumping back to home dir
-        os.chdir(sCurDir)
-
     def __get_file_md5(self, sFileName: str) -> str:
         ## Process file without chunking
         md5CheckSummer = md5()
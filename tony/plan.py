@@ -0,0 +1,104 @@
+import time
+import asyncio
+
+from .task import BaseTask
+from .utils import log
+from .broadcaster import Broadcaster
+
+class PlanStep:
+
+    PENDING: str = "PENDING"
+    RUNNING: str = "RUNNING"
+    DONE: str = "DONE"
+    FAILED: str = "FAILED"
+    SKIPPED: str = "SKIPPED"
+
+    def __init__(self, sName: str, fnStep, lDepends: tuple[str] = ()):
+        self.sName = sName
+        self.fnStep = fnStep ## Callable returning awaitable
+        self.lDepends = tuple(lDepends)
+        self.sState = self.PENDING
+        self.ttStart, self.ttEnd = 0.0, 0.0
+
+    def get_duration(self) -> float:
+        return self.ttEnd - self.ttStart if self.ttEnd > 0 else 0.0
+
+class TaskPlan:
+    def __init__(self, rBroadcaster: Broadcaster, sName: str):
+        self.rBroadcaster = rBroadcaster
+        self.sName = sName
+        self.dSteps: dict[str, PlanStep] = {}
+
+    def add_step(self, sName: str, fnStep, lDepends: tuple[str] = ()) -> None:
+        if sName in self.dSteps:
+            raise ValueError(f"Step {sName} is already a part of plan {self.sName}")
+
+        self.dSteps[sName] = PlanStep(sName, fnStep, lDepends)
+
+    def add_commands(self, sName: str, lCommand: tuple, lDepends: tuple[str] = (), **kwargs) -> None:
+        ## Every command step gets its own task, so it walks its own directory
+        async def run_commands() -> None:
+            rTask = BaseTask(self.rBroadcaster, lCommand = lCommand)
+            await rTask.run(**kwargs)
+            if not kwargs.get("bIgnoreResults", False) and not rTask.check_results():
+                raise RuntimeError(rTask.lResults[2])
+
+        self.add_step(sName, run_commands, lDepends)
+
+    def get_state(self, sName: str) -> str:
+        return self.dSteps[sName].sState
+
+    def check_results(self) -> bool:
+        return all(rStep.sState == PlanStep.DONE for rStep in self.dSteps.values())
+
+    async def run(self, bReport: bool = True) -> bool:
+        for rStep in self.dSteps.values():
+            lMissing = [sDep for sDep in rStep.lDepends if not sDep in self.dSteps]
+            if len(lMissing) > 0:
+                raise ValueError(f"Step {rStep.sName} depends on unknown steps: {', '.join(lMissing)}")
+
+        ttStart = time.time()
+        dRunning = {}
+        while True:
+            ## Start everything whose dependencies are done, drop everything that can't run anymore
+            for rStep in self.dSteps.values():
+                if rStep.sState != PlanStep.PENDING:
+                    continue
+
+                lDepStates = [self.dSteps[sDep].sState for sDep in rStep.lDepends]
+                if any(sState in (PlanStep.FAILED, PlanStep.SKIPPED) for sState in lDepStates):
+                    rStep.sState = PlanStep.SKIPPED
+                elif all(sState == PlanStep.DONE for sState in lDepStates):
+                    rStep.sState = PlanStep.RUNNING
+                    rStep.ttStart = time.time()
+                    dRunning[asyncio.ensure_future(rStep.fnStep())] = rStep
+
+            if len(dRunning) == 0:
+                break
+
+            lDone, _ = await asyncio.wait(set(dRunning), return_when=asyncio.FIRST_COMPLETED)
+            for hFuture in lDone:
+                rStep = dRunning.pop(hFuture)
+                rStep.ttEnd = time.time()
+                if hFuture.exception():
+                    rStep.sState = PlanStep.FAILED
+                    log(f"Step {rStep.sName} of {self.sName} failed: {hFuture.exception()}", "error")
+                else:
+                    rStep.sState = PlanStep.DONE
+
+        ## Whatever is still pending waits on a cycle
+        for rStep in self.dSteps.values():
+            if rStep.sState == PlanStep.PENDING:
+                rStep.sState = PlanStep.SKIPPED
+
+        if bReport:
+            await self.rBroadcaster.send(self.get_report(time.time() - ttStart))
+
+        return self.check_results()
+
+    def get_report(self, fTotal: float) -> str:
+        sReport = f"{self.sName} timings:\n"
+        for rStep in self.dSteps.values():
+            sReport += f"{rStep.sName}: *{rStep.sState}* {rStep.get_duration():.1f}s\n"
+
+        return sReport + f"Total: {fTotal:.1f}s"
@@ -0,0 +1,115 @@
+from contextlib import asynccontextmanager
+
+from tornado.locks import Condition
+from .jobs import JobRegistry_Singleton
+from .broadcaster import Broadcaster
+
+class ReadWriteLock:
+    def __init__(self):
+        self.iReaders = 0
+        self.bWriter = False
+        self.iWaitingWriters = 0
+        self.cCondition = Condition()
+
+    ## Waiting writers block new readers, so a stream of status checks can't starve a rebuild
+    def can_read(self) -> bool:
+        return not self.bWriter and self.iWaitingWriters == 0
+
+    def can_write(self) -> bool:
+        return not self.bWriter and self.iReaders == 0
+
+    async def acquire_read(self) -> None:
+        while not self.can_read():
+            await self.cCondition.wait()
+
+        self.iReaders += 1
+
+    def release_read(self) -> None:
+        self.iReaders -= 1
+        if self.iReaders == 0:
+            self.cCondition.notify_all()
+
+    async def acquire_write(self) -> None:
+        self.iWaitingWriters += 1
+        try:
+            while not self.can_write():
+                await self.cCondition.wait()
+        finally:
+            self.iWaitingWriters -= 1
+
+        self.bWriter = True
+
+    def release_write(self) -> None:
+        self.bWriter = False
+        self.cCondition.notify_all()
+
+class ResourceScheduler:
+
+    CORE: str = "CORE" ## Core repository and its build
+    LOCALE: str = "LOCALE" ## Locale repository
+    PATCHER: str = "PATCHER" ## Patcher repository and its files list
+    GAME: str = "GAME" ## Running game processes
+    QUEST: str = "QUEST" ## Quest objects
+
+    REPOSITORY_RESOURCES: dict = {
+        "core" : (CORE, ),
+        "locale" : (LOCALE, ),
+        "patcher" : (PATCHER, ),
+        "all" : (CORE, LOCALE, PATCHER),
+    }
+
+    def __init__(self):
+        self.dLocks: dict[str, ReadWriteLock] = {}
+
+    def get_lock(self, sResource: str) -> ReadWriteLock:
+        if not sResource in self.dLocks:
+            self.dLocks[sResource] = ReadWriteLock()
+
+        return self.dLocks[sResource]
+
+    def get_repository_resources(self, sType: str) -> tuple[str]:
+        ## Unknown types hold nothing, branch management will complain about them anyway
+        return self.REPOSITORY_RESOURCES.get(sType.lower(), ())
+
+    @asynccontextmanager
+    async def reserve(self, lWrite: tuple[str] = (), lRead: tuple[str] = (), rBroadcaster: Broadcaster = None):
+        ## Write wins if resource was asked both ways
+        dModes = {sResource : False for sResource in lRead}
+        dModes.update({sResource : True for sResource in lWrite})
+
+        ## Always lock in the same order, two jobs can't deadlock each other this way
+        lTaken = []
+        try:
+            for sResource in sorted(dModes):
+                rLock = self.get_lock(sResource)
+                bWrite = dModes[sResource]
+                rJob = None
+                if not (rLock.can_write() if bWrite else rLock.can_read()):
+                    rJob = JobRegistry_Singleton.get_current()
+                    if rJob:
+                        rJob.set_step(f"Waiting for {sResource}", rLock)
+                    if rBroadcaster:
+                        await rBroadcaster.send(f"{sResource.capitalize()} is busy with another request, waiting in queue..")
+
+                try:
+                    if bWrite:
+                        await rLock.acquire_write()
+                    else:
+                        await rLock.acquire_read()
+                finally:
+                    if rJob:
+                        rJob.end_step(rLock)
+
+                lTaken.append((rLock, bWrite))
+
+            yield
+        finally:
+            for rLock, bWrite in reversed(lTaken):
+                if bWrite:
+                    rLock.release_write()
+                else:
+                    rLock.release_read()
+
+
+## Singleton class for scheduler
+Scheduler_Singleton = ResourceScheduler()
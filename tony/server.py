@@ -1,105 +1,420 @@
 import os
+import re
+import time
+import json
+import shutil
+import asyncio
+from hashlib import sha256
 
+from tornado.ioloop import IOLoop
 from .task import BaseTask
+from .plan import TaskPlan, PlanStep
+from .artifacts import ArtifactStore
 from .branch import BranchManagement
-from .utils import CONSTANTS
+from .api import GameStatusChecker
+from .jobs import JobRegistry_Singleton
+from .utils import CONSTANTS, log, load_state, save_state
 from .broadcaster import Broadcaster
 
+class QuestBuildCache:
+
+    CACHE_NAME: str = ".quest_cache.json"
+    SHARED_FILES: tuple[str] = ("qc", "quest_functions") ## Every quest depends on these
+    INCLUDE_PATTERN = re.compile(r"""^\s*(?:import|include|dofile)\s*\(?\s*["']([^"']+)["']""", re.MULTILINE)
+
+    def __init__(self, sQuestDir: str):
+        self.sQuestDir = sQuestDir
+        self.sCachePath = os.path.join(sQuestDir, self.CACHE_NAME)
+        self.dEntries = {} ## quest -> {"digest" : ..., "outputs" : [paths relative to object]}
+        self.dSources: dict[str, list[str]] = {} ## quest -> files its digest was made of
+        self.sSharedDigest = ""
+
+    def load(self) -> bool:
+        ## Returns False if there was no usable cache, outputs of such build are unknown
+        try:
+            with open(self.sCachePath, "r", encoding="utf-8") as hFile:
+                dEntries = json.load(hFile)
+        except (OSError, ValueError):
+            dEntries = None
+
+        bValid = isinstance(dEntries, dict) and all(isinstance(dEntry, dict) and "digest" in dEntry and "outputs" in dEntry for dEntry in dEntries.values())
+        self.dEntries = dEntries if bValid else {}
+        return bValid
+
+    def hash_shared_files(self) -> None:
+        ## Compiler or shared functions changed, every quest has to be hashed against it
+        hDigest = sha256()
+        for sFile in self.SHARED_FILES:
+            hDigest.update(self.__read(os.path.join(self.sQuestDir, sFile)))
+
+        self.sSharedDigest = hDigest.hexdigest()
+
+    def save(self, lQuests: list[str]) -> None:
+        ## Forget quests which are not listed anymore
+        dEntries = {sQuest : self.dEntries[sQuest] for sQuest in lQuests if sQuest in self.dEntries}
+        sTmpPath = self.sCachePath + ".tmp"
+        try:
+            with open(sTmpPath, "w", encoding="utf-8") as hFile:
+                json.dump(dEntries, hFile)
+
+            os.replace(sTmpPath, self.sCachePath)
+        except OSError as e:
+            log(f"Couldn't save quest build cache: {e}", "warning")
+
+    def clear(self) -> None:
+        self.dEntries = {}
+        try:
+            os.remove(self.sCachePath)
+        except FileNotFoundError:
+            pass
+
+    def get_digest(self, sQuest: str) -> str:
+        hDigest = sha256(self.sSharedDigest.encode())
+        lPending, lSeen = [sQuest], set()
+        while len(lPending) > 0:
+            sFile = lPending.pop()
+            if sFile in lSeen:
+                continue
+
+            lSeen.add(sFile)
+            bData = self.__read(os.path.join(self.sQuestDir, sFile))
+            hDigest.update(sFile.encode() + b"\x00" + bData)
+
+            ## Follow includes relatively to including file
+            sBaseDir = os.path.dirname(sFile)
+            for sInclude in self.INCLUDE_PATTERN.findall(bData.decode(CONSTANTS["ENCODING_TYPE"], "ignore")):
+                lPending.append(os.path.normpath(os.path.join(sBaseDir, sInclude)))
+
+        self.dSources[sQuest] = sorted(lSeen)
+        return hDigest.hexdigest()
+
+    def get_sources(self, sQuest: str) -> list[str]:
+        ## Everything compiler reads for the quest, known once its digest was made
+        return list(self.SHARED_FILES) + self.dSources.get(sQuest, [sQuest])
+
+    def get_outputs(self, sQuest: str) -> list[str]:
+        return self.dEntries.get(sQuest, {}).get("outputs", [])
+
+    def get_unlisted(self, lQuests: list[str]) -> list[str]:
+        return [sQuest for sQuest in self.dEntries if not sQuest in lQuests]
+
+    def is_fresh(self, sQuest: str, sDigest: str) -> bool:
+        return self.dEntries.get(sQuest, {}).get("digest") == sDigest
+
+    def update(self, sQuest: str, sDigest: str | None, lOutputs: list[str]) -> None:
+        if sDigest is None:
+            self.dEntries.pop(sQuest, None)
+        else:
+            self.dEntries[sQuest] = {"digest" : sDigest, "outputs" : lOutputs}
+
+    def __read(self, sPath: str) -> bytes:
+        try:
+            with open(sPath, "rb") as hFile:
+                return hFile.read()
+        except OSError:
+            return b""
+
 class ServerManagement(BaseTask):
 
     LIST_NAME: str = "locale_list"
+    CORE_BUILD_STATE: str = "core_build"
+    STARTUP_STATE: str = "startup_timings"
+    STARTUP_HISTORY_SIZE: int = 20
+    COMPILATION_TIMEOUT: int = int(os.getenv("COMPILATION_TIMEOUT", str(60*60)))
+    QUEST_BUILD_DIRECTORY: str = ".build" ## Per quest sandboxes, each with own object directory
     SOURCE_COMPILATION: tuple[str, str] = (("cd {}/{}".format(CONSTANTS["BASE_DIRECTORY"], CONSTANTS["CORE_RELATIVE_PATH"]), "Entering source directory.."), (CONSTANTS["COMPILATION_COMMAND"], "Rebuilding source from scratches.."))
     QUEST_COMPILATION_PREBUILD: tuple[str, str] = (("cd {}/{}".format(CONSTANTS["BASE_DIRECTORY"], CONSTANTS["QUEST_RELATIVE_PATH"]), "Entering quest directory.."), 
-                        ("rm -rf object", "Removing object direcory.."),
+                        ("rm -rf object {}".format(QUEST_BUILD_DIRECTORY), "Removing object direcory.."),
                         ("mkdir object", "Recreacting object directory.."),
     )
+    QUEST_COMPILATION_PREPARE: tuple[str, str] = (("cd {}/{}".format(CONSTANTS["BASE_DIRECTORY"], CONSTANTS["QUEST_RELATIVE_PATH"]), "Entering quest directory.."),
+                        ("mkdir -p object", "Making sure object directory exists.."),
+    )
     QUEST_COMPILATION_COMMAND: str = "./qc {}"
+    QUEST_COMPILATION_WORKERS: int = int(os.getenv("QUEST_COMPILATION_WORKERS", "0")) or os.cpu_count() or 1
     SERVER_START: tuple[str, str] = (("cd {}/{}".format(CONSTANTS["BASE_DIRECTORY"], CONSTANTS["SERVER_RELATIVE_PATH"]), "Entering server directory.."), (CONSTANTS["START_COMMAND"], "Starting server.."))
     SERVER_STOP: tuple[str, str] = (("cd {}/{}".format(CONSTANTS["BASE_DIRECTORY"], CONSTANTS["SERVER_RELATIVE_PATH"]), "Entering server directory.."), (CONSTANTS["STOP_COMMAND"], "Stopping server.."))
+    ROLLING_RESTART_BATCH: int = int(os.getenv("ROLLING_RESTART_BATCH", "1"))
+    CHANNEL_READY_TIMEOUT: int = int(os.getenv("CHANNEL_READY_TIMEOUT", "120"))
 
     def __init__(self, rBroadcaster: Broadcaster):
         super().__init__(rBroadcaster)
 
-    async def rebuild_core(self) -> None:
-        ## Stop server
+    async def rebuild_core(self, bForce: bool = False) -> bool:
+        cBranch = BranchManagement(self.rBroadcaster)
+        rPlan = TaskPlan(self.rBroadcaster, "Core rebuild")
+
+        if bForce:
+            ## Server goes down only once there is something to build, failed pull leaves it running
+            rPlan.add_step("pull", lambda: self.__update_repository(cBranch, "CORE"))
+            rPlan.add_step("stop", self.__stop_before_rebuild, ("pull", ))
+            rPlan.add_step("compile", lambda: self.__compile_core(cBranch), ("stop", ))
+        else:
+            ## Pull first, there might be nothing to build at all
+            await self.__update_repository(cBranch, "CORE")
+            sHead = await cBranch.get_head("CORE", bSilentCall = True)
+            if len(sHead) > 0 and sHead == load_state(self.CORE_BUILD_STATE).get("head") and self.__check_core_binaries():
+                await self.rBroadcaster.send(f"Core is already built from {sHead[:10]}, skipping rebuild. Use `force` to rebuild anyway.")
+                return False
+
+            ## Commit was built before, bring its binaries back instead of compiling
+            if await self.restore_core(sHead):
+                return True
+
+            rPlan.add_step("stop", self.__stop_before_rebuild)
+            rPlan.add_step("compile", lambda: self.__compile_core(cBranch), ("stop", ))
+
+        rPlan.add_step("start", self.__start_after_rebuild, ("compile", ))
+        if not await rPlan.run():
+            ## Binaries of a failed build can't be trusted, so server isn't brought back on its own
+            if rPlan.get_state("stop") == PlanStep.DONE and rPlan.get_state("start") != PlanStep.DONE:
+                await self.rBroadcaster.send("Server was stopped for the rebuild and is *left stopped*! Fix the build and rebuild or start it again.")
+
+            ## False is reserved for "nothing to build", failure has to reach handler as an error
+            raise RuntimeError("Core rebuild failed, see step timings for the failed step")
+
+        return True
+
+    async def restore_core(self, sHead: str) -> bool:
+        ## Running build is already this commit, no need to take server down
+        if len(sHead) > 0 and sHead == load_state(self.CORE_BUILD_STATE).get("head") and self.__check_core_binaries():
+            await self.rBroadcaster.send(f"Core is already built from {sHead[:10]}, no restart needed.")
+            return True
+
+        rStore = ArtifactStore()
+        if not rStore.has(sHead):
+            return False
+
+        await self.rBroadcaster.send(f"Found stored build of {sHead[:10]}, restoring it instead of compiling..")
+        await self.__stop_before_rebuild()
+        if not await rStore.restore(sHead):
+            ## Binaries might be half swapped, don't run them and don't claim any build either
+            save_state(self.CORE_BUILD_STATE, {"head" : ""})
+            await self.rBroadcaster.send("Couldn't restore stored build! Server was left stopped, it needs a rebuild.")
+            return False
+
+        save_state(self.CORE_BUILD_STATE, {"head" : sHead})
+        await self.__start_after_rebuild()
+        return True
+
+    def __check_core_binaries(self) -> bool:
+        ## Without configured binaries we can't tell the build is still there, so never skip
+        if len(CONSTANTS["CORE_BINARIES"]) == 0:
+            return False
+
+        return all(os.path.isfile(os.path.join(CONSTANTS["BASE_DIRECTORY"], sPath)) for sPath in CONSTANTS["CORE_BINARIES"])
+
+    async def __stop_before_rebuild(self) -> None:
         await self.rBroadcaster.send("Stopping server if running..")
         await self.stop_game(bIgnoreResults = True) ## Try to stop game regardless of current status
 
-        ## Update repo
+    async def __update_repository(self, cBranch: BranchManagement, sType: str) -> None:
         await self.rBroadcaster.send("Updating server repo..")
-        cBranch = BranchManagement(self.rBroadcaster)
-        await cBranch.update_repository("CORE")
+        await cBranch.update_repository(sType)
+
+        ## Plan can only tell the step failed if it raises
+        if not cBranch.check_results():
+            raise RuntimeError(f"Updating {sType.lower()} repository failed: {cBranch.lResults[2]}")
 
+    async def __compile_core(self, cBranch: BranchManagement) -> None:
         ## Run rebuild script
         await self.rBroadcaster.send("Rebuilding core..")
         self.lCommand = self.SOURCE_COMPILATION
-        await self.run()
+        await self.run(bStreamOutput = True, iTimeout = self.COMPILATION_TIMEOUT) ## Compilation takes a while, let people watch it
+        if not self.check_results():
+            raise RuntimeError(f"Core compilation failed: {self.lResults[2]}")
+
+        ## Mark what was built, so the same commit won't be built twice
+        sHead = await cBranch.get_head("CORE", bSilentCall = True)
+        save_state(self.CORE_BUILD_STATE, {"head" : sHead})
 
+        ## Keep binaries around, switching back to this commit won't need compilation
+        if await ArtifactStore().store(sHead):
+            await self.rBroadcaster.send(f"Build of {sHead[:10]} was stored for later switches.")
+
+    async def __start_after_rebuild(self) -> None:
         ## Start game again
         await self.rBroadcaster.send("Starting server..")
-        await self.start_game()
+        bReady = await self.start_game()
+        if not self.check_results():
+            raise RuntimeError(f"Server start failed after rebuild: {self.lResults[2]}")
 
-    async def rebuild_quest(self) -> None:
-        await self.rBroadcaster.send("Cleaning up old work..")
-        ## Run prebuild events
-        self.lCommand = self.QUEST_COMPILATION_PREBUILD
-        await self.run()
+        ## Build itself is fine, slow channels are only worth a note
+        if not bReady:
+            await self.rBroadcaster.send("Server was started, but not every channel is up!")
 
-        ## Keep directory
-        sCurDir = os.getcwd()
+    async def rebuild_quest(self, bForce: bool = False) -> None:
+        ## Run everything from quest directory
+        sQuestDir = os.path.join(CONSTANTS["BASE_DIRECTORY"], CONSTANTS["QUEST_RELATIVE_PATH"])
+        self.sWorkDir = sQuestDir
 
-        ## Move into quest directory
-        os.chdir(os.path.join(CONSTANTS["BASE_DIRECTORY"], CONSTANTS["QUEST_RELATIVE_PATH"]))
+        ## Without cache we don't know which file in object belongs to which quest, start from scratch then
+        rCache = QuestBuildCache(sQuestDir)
+        bClean = bForce or not rCache.load() or not os.path.isdir(os.path.join(sQuestDir, "object"))
+        if bClean:
+            rCache.clear()
 
-        ## Update repo
-        await self.rBroadcaster.send("Updating server repo..")
+        ## Cleanup and repo update touch different things, let them run side by side
         cBranch = BranchManagement(self.rBroadcaster)
-        await cBranch.update_repository("LOCALE")
+        rPlan = TaskPlan(self.rBroadcaster, "Quest rebuild")
+        rPlan.add_commands("cleanup", self.QUEST_COMPILATION_PREBUILD if bClean else self.QUEST_COMPILATION_PREPARE)
+        rPlan.add_step("pull", lambda: self.__update_repository(cBranch, "LOCALE"))
+        await self.rBroadcaster.send("Cleaning up old work.." if bClean else "Preparing incremental build..")
+        if not await rPlan.run():
+            raise RuntimeError("Quest rebuild was stopped, preparing quest directory or updating locale failed")
 
         await self.rBroadcaster.send("Rebuilding quests..")
         ## Recreate locale_list
-        with open(self.LIST_NAME, mode="r+", encoding=CONSTANTS["ENCODING_TYPE"]) as fList:
-            ## Keep track on compilation success rate
-            sOutput = ""
-            iCount = 0
-            iFullCount = 0
-
-            for line in fList:
-                ## Refactored make.py
-                iFullCount += 1
-                filename = line
-
-                self.lCommand = ((self.QUEST_COMPILATION_COMMAND.format(filename), ""), )
-                sOutput += f"Compiling {line.strip()}.." + "\n"
-
-                try:
-                    await self.run()
-                except Exception:
-                    pass
-
-                if not self.check_results():
-                    sOutput = f"An error occured during compilation of {line}"
-                    sOutput = "Compilation outputs following error:"
-                    sOutput = self.lResults[2]
-                    continue
-                else:
-                    sOutput += f"{line.strip()} was compiled successfully!" + "\n"
-                    iCount += 1
-
-            ## Send output as one message
-            ## We don't jam slack with tons of notifications
+        with open(os.path.join(sQuestDir, self.LIST_NAME), mode="r", encoding=CONSTANTS["ENCODING_TYPE"]) as fList:
+            lQuests = [line.strip() for line in fList if len(line.strip()) > 0]
+
+        ## Quests dropped from the list must not leave anything for the game to load
+        await IOLoop.current().run_in_executor(None, self.__remove_unlisted, sQuestDir, rCache, lQuests)
+
+        ## Only quests whose sources, includes or compiler changed are compiled again
+        rCache.hash_shared_files()
+        dDigests = {sQuest : rCache.get_digest(sQuest) for sQuest in lQuests}
+        lStale = [sQuest for sQuest in lQuests if not rCache.is_fresh(sQuest, dDigests[sQuest])]
+
+        ## Each quest compiles on its own, so keep all workers busy
+        await self.rBroadcaster.send(f"Compiling {len(lStale)} quests with {self.QUEST_COMPILATION_WORKERS} workers, {len(lQuests) - len(lStale)} are up to date..")
+        hSemaphore = asyncio.Semaphore(self.QUEST_COMPILATION_WORKERS)
+        rJob = JobRegistry_Singleton.get_current()
+        if rJob:
+            rJob.set_step(f"Compiling {len(lStale)} quests", self)
+        lCompiled = await asyncio.gather(*(self.__compile_quest(sQuest, sQuestDir, rCache.get_sources(sQuest), hSemaphore) for sQuest in lStale))
+        if rJob:
+            rJob.end_step(self)
+
+        ## Moving outputs around touches a lot of files, keep loop free meanwhile
+        sOutput, iCompiled = await IOLoop.current().run_in_executor(None, self.__apply_results, sQuestDir, rCache, lCompiled, dDigests)
+        iCount = len(lQuests) - len(lStale) + iCompiled
+        rCache.save(lQuests)
+
+        ## Send output as one message
+        ## We don't jam slack with tons of notifications
+        if len(sOutput) > 0:
             await self.rBroadcaster.send(sOutput[:-1])
-            self.lCommand = (("chmod -R 770 object", "Setting permission to object folder.."), )
-            await self.run()
-            await self.rBroadcaster.send(f"{iCount}/{iFullCount} quests were compiled successfully!")
 
-            ## Move back to main dir
-            os.chdir(sCurDir)
+        self.lCommand = (("chmod -R 770 object", "Setting permission to object folder.."), )
+        await self.run()
+        await self.rBroadcaster.send(f"{iCount}/{len(lQuests)} quests are compiled and up to date!")
+
+    async def __compile_quest(self, sQuest: str, sQuestDir: str, lSources: list[str], hSemaphore: asyncio.Semaphore) -> tuple[str, list, list[str]]:
+        async with hSemaphore:
+            ## Every quest compiles in its own sandbox with empty object, so we know exactly what it produced
+            sSandbox = self.__get_sandbox(sQuestDir, sQuest)
+            try:
+                await IOLoop.current().run_in_executor(None, self.__prepare_sandbox, sQuestDir, sSandbox, lSources)
+            except OSError as e:
+                return sQuest, [1, "", f"Couldn't prepare build directory: {e}"], []
+
+            ## Separate task per quest, results of parallel runs can't overwrite each other
+            rTask = BaseTask(self.rBroadcaster, lCommand = ((self.QUEST_COMPILATION_COMMAND.format(sQuest), ""), ))
+            rTask.sWorkDir = sSandbox
+            await rTask.run(bIgnoreResults = True, bTrackStep = False) ## Errors are reported within summary, compiling is one phase of the job
+
+            lOutputs = await IOLoop.current().run_in_executor(None, self.__list_outputs, sSandbox)
+            return sQuest, rTask.lResults, lOutputs
+
+    def __get_sandbox(self, sQuestDir: str, sQuest: str) -> str:
+        return os.path.join(sQuestDir, self.QUEST_BUILD_DIRECTORY, sha256(sQuest.encode()).hexdigest()[:16])
+
+    def __prepare_sandbox(self, sQuestDir: str, sSandbox: str, lSources: list[str]) -> None:
+        ## Only compiler, quest and its includes are linked (by their top directory), object is private
+        shutil.rmtree(sSandbox, ignore_errors=True)
+        os.makedirs(os.path.join(sSandbox, "object"))
+        setNames = {sPath.split(os.sep)[0] for sPath in lSources} - {"object", self.QUEST_BUILD_DIRECTORY, "..", "."}
+        for sName in setNames:
+            if os.path.lexists(os.path.join(sQuestDir, sName)):
+                os.symlink(os.path.join(sQuestDir, sName), os.path.join(sSandbox, sName))
+
+    def __list_outputs(self, sSandbox: str) -> list[str]:
+        sObjectDir = os.path.join(sSandbox, "object")
+        return sorted(os.path.relpath(os.path.join(sRoot, sFile), sObjectDir) for sRoot, _, lFiles in os.walk(sObjectDir) for sFile in lFiles)
+
+    def __apply_results(self, sQuestDir: str, rCache: QuestBuildCache, lCompiled: list, dDigests: dict) -> tuple[str, int]:
+        ## Keep track on compilation success rate
+        sOutput = ""
+        iCompiled = 0
+        for sQuest, lResults, lOutputs in lCompiled:
+            ## Whatever previous build produced and this one didn't is gone, failed quest leaves nothing behind
+            bCompiled = lResults[0] == 0
+            self.__remove_outputs(sQuestDir, rCache, sQuest, lOutputs if bCompiled else [])
+            if not bCompiled:
+                shutil.rmtree(self.__get_sandbox(sQuestDir, sQuest), ignore_errors=True)
+                rCache.update(sQuest, None, [])
+                sOutput += f"An error occured during compilation of {sQuest}, compilation outputs following error:\n{lResults[2].strip() or lResults[1].strip()}\n"
+            else:
+                self.__install_outputs(sQuestDir, sQuest, lOutputs)
+                rCache.update(sQuest, dDigests[sQuest], lOutputs)
+                sOutput += f"{sQuest} was compiled successfully!\n"
+                iCompiled += 1
+
+        return sOutput, iCompiled
+
+    def __remove_unlisted(self, sQuestDir: str, rCache: QuestBuildCache, lQuests: list[str]) -> None:
+        for sQuest in rCache.get_unlisted(lQuests):
+            self.__remove_outputs(sQuestDir, rCache, sQuest, [])
+            rCache.update(sQuest, None, [])
+
+    def __install_outputs(self, sQuestDir: str, sQuest: str, lOutputs: list[str]) -> None:
+        sSandbox = self.__get_sandbox(sQuestDir, sQuest)
+        for sPath in lOutputs:
+            sTarget = os.path.join(sQuestDir, "object", sPath)
+            os.makedirs(os.path.dirname(sTarget), exist_ok=True)
+            os.replace(os.path.join(sSandbox, "object", sPath), sTarget)
+
+        shutil.rmtree(sSandbox, ignore_errors=True)
 
-    async def start_game(self, **kwargs) -> None:
+    def __remove_outputs(self, sQuestDir: str, rCache: QuestBuildCache, sQuest: str, lKeep: list[str]) -> None:
+        ## Files other quests still own stay where they are
+        setKeep = set(lKeep)
+        for sOther, dEntry in rCache.dEntries.items():
+            if sOther != sQuest:
+                setKeep.update(dEntry["outputs"])
+
+        for sPath in rCache.get_outputs(sQuest):
+            if sPath in setKeep:
+                continue
+
+            try:
+                os.remove(os.path.join(sQuestDir, "object", sPath))
+            except FileNotFoundError:
+                pass
+
+    async def start_game(self, bWaitReady: bool = True, **kwargs) -> bool:
         self.lCommand = self.SERVER_START
         await self.run(bSkipOutput = True, **kwargs) ## Skip output (we don't need that much of data processed)
 
+        ## Script is done, but channels may still be loading
+        if not bWaitReady or not self.check_results():
+            return self.check_results()
+
+        return await self.wait_for_ready()
+
+    async def wait_for_ready(self) -> bool:
+        await self.rBroadcaster.send("Waiting for channels to accept connections..")
+        dTimes = await GameStatusChecker(self.rBroadcaster).wait_for_ready(self.CHANNEL_READY_TIMEOUT)
+
+        ## Keep history per build, regressions in startup time show up this way
+        lHistory = load_state(self.STARTUP_STATE).get("history", [])
+        dPrevious = lHistory[-1].get("times", {}) if len(lHistory) > 0 else {}
+        sReturnStr = "Startup timings:\n"
+        for sName, fTime in dTimes.items():
+            if fTime is None:
+                sReturnStr += f"{sName}: *NOT READY* after {self.CHANNEL_READY_TIMEOUT}s\n"
+                continue
+
+            sDelta = f" ({fTime - dPrevious[sName]:+.1f}s)" if dPrevious.get(sName) is not None else ""
+            sReturnStr += f"{sName}: *{fTime:.1f}s*{sDelta}\n"
+
+        await self.rBroadcaster.send(sReturnStr[:-1])
+        lHistory = lHistory + [{"started" : time.time(), "head" : load_state(self.CORE_BUILD_STATE).get("head", ""), "times" : dTimes}]
+        save_state(self.STARTUP_STATE, {"history" : lHistory[-self.STARTUP_HISTORY_SIZE:]})
+
+        return all(fTime is not None for fTime in dTimes.values())
+
     async def stop_game(self, **kwargs) -> None:
         self.lCommand = self.SERVER_STOP
         await self.run(bSkipOutput = True, **kwargs) ## Skip output (we don't need that much of data processed)
@@ -109,6 +424,46 @@ class ServerManagement(BaseTask):
         await self.stop_game(**kwargs)
         await self.start_game(**kwargs)
     
+    async def rolling_restart(self, iBatch: int = 0) -> bool:
+        if len(CONSTANTS["CHANNEL_START_COMMAND"]) == 0 or len(CONSTANTS["CHANNEL_STOP_COMMAND"]) == 0:
+            await self.rBroadcaster.send("Per channel commands are not configured, restarting whole server instead..")
+            await self.restart_game()
+            return self.check_results()
+
+        ## Auth stays untouched, channels go down a batch at a time
+        iBatch = max(1, iBatch or self.ROLLING_RESTART_BATCH)
+        lChannels = list(zip(CONSTANTS["GAME_PORTS_NAME"], CONSTANTS["GAME_PORTS"]))
+        for iNum in range(0, len(lChannels), iBatch):
+            lBatch = lChannels[iNum:iNum + iBatch]
+            await self.rBroadcaster.send("Restarting {}..".format(", ".join(sName for sName, _ in lBatch)))
+            lRestarted = await asyncio.gather(*(self.__restart_channel(sName, iPortNum) for sName, iPortNum in lBatch))
+
+            ## Don't take down more channels if this batch didn't make it
+            lFailed = [sName for (sName, _), bRestarted in zip(lBatch, lRestarted) if not bRestarted]
+            if len(lFailed) > 0:
+                await self.rBroadcaster.send("{} didn't come back, rolling restart was stopped!".format(", ".join(lFailed)))
+                return False
+
+            await self.rBroadcaster.send("{} {} up again!".format(", ".join(sName for sName, _ in lBatch), "is" if len(lBatch) == 1 else "are"))
+
+        return True
+
+    async def __restart_channel(self, sName: str, iPortNum) -> bool:
+        sServerDir = "cd {}/{}".format(CONSTANTS["BASE_DIRECTORY"], CONSTANTS["SERVER_RELATIVE_PATH"])
+        rChecker = GameStatusChecker(self.rBroadcaster)
+
+        rTask = BaseTask(self.rBroadcaster, lCommand = ((sServerDir, ""), (CONSTANTS["CHANNEL_STOP_COMMAND"].format(sName), "")))
+        await rTask.run(bSkipOutput = True, bSilentCall = True)
+        if not rTask.check_results() or await rChecker.wait_for_port(iPortNum, "OFF", self.CHANNEL_READY_TIMEOUT) is None:
+            return False
+
+        rTask.lCommand = ((sServerDir, ""), (CONSTANTS["CHANNEL_START_COMMAND"].format(sName), ""))
+        await rTask.run(bSkipOutput = True, bSilentCall = True)
+        if not rTask.check_results():
+            return False
+
+        return await rChecker.wait_for_port(iPortNum, "ON", self.CHANNEL_READY_TIMEOUT) is not None
+
     async def update_server(self, **_) -> None:
         eventBranch = BranchManagement(self.rBroadcaster)
         await eventBranch.update_repository("LOCALE")
@@ -1,37 +1,92 @@
 import os
 import time
-import subprocess
+import signal
+import asyncio
+from collections import deque
 
-from tornado import gen
 from .broadcaster import Broadcaster
-from .utils import CONSTANTS
+from .jobs import JobRegistry_Singleton
+from .utils import CONSTANTS, log
+
+class OutputCapture:
+    ## Keeps first and last half of the limit, everything in between is only counted (and spooled if asked)
+    def __init__(self, iLimit: int, hSpool = None):
+        self.iHeadLimit = iLimit // 2
+        self.iTailLimit = iLimit - self.iHeadLimit
+        self.bHead = bytearray()
+        self.bTail = bytearray()
+        self.iSkipped = 0
+        self.hSpool = hSpool
+
+    def write(self, bChunk: bytes) -> None:
+        if self.hSpool:
+            self.hSpool.write(bChunk)
+
+        ## Fill head first
+        iRoom = self.iHeadLimit - len(self.bHead)
+        if iRoom > 0:
+            self.bHead += bChunk[:iRoom]
+            bChunk = bChunk[iRoom:]
+
+        ## Then keep rolling the tail
+        self.bTail += bChunk
+        iExcess = len(self.bTail) - self.iTailLimit
+        if iExcess > 0:
+            del self.bTail[:iExcess]
+            self.iSkipped += iExcess
+
+    def get_value(self) -> str:
+        if self.iSkipped == 0:
+            return (self.bHead + self.bTail).decode(errors="replace")
+
+        sSpool = f", full log: {self.hSpool.name}" if self.hSpool else ""
+        return "{}\n... [{} bytes skipped{}] ...\n{}".format(self.bHead.decode(errors="replace"), self.iSkipped, sSpool, self.bTail.decode(errors="replace"))
 
 class BaseTask:
 
-    DEFAULT_TIMEOUT: int = 60*5
+    DEFAULT_TIMEOUT: int = int(os.getenv("COMMAND_TIMEOUT", str(60*5)))
+    STREAM_LINES: int = int(os.getenv("STREAM_LINES", "10"))
+    STREAM_INTERVAL: float = float(os.getenv("STREAM_INTERVAL", "15"))
+    READER_GRACE: float = 1.0
+    OUTPUT_LIMIT: int = int(os.getenv("OUTPUT_CAPTURE_LIMIT", str(256*1024)))
+    OUTPUT_SPOOL_DIRECTORY: str = os.getenv("OUTPUT_SPOOL_DIRECTORY", "")
 
     def __init__(self, rBroadcaster: Broadcaster, user: str = CONSTANTS["SERVER_USER"], lCommand: str = ""):
         self.rBroadcaster = rBroadcaster
         self.sUserName = user
         self.lCommand = lCommand
         self.lResults = [-1, "NOT SET", "NOT SET"]
+        self.sWorkDir = None ## Directory each run starts from, None means app's one
 
     def __del__(self):
         pass
 
-    async def run(self, bSkipOutput: bool = False, bIgnoreResults: bool = False, bSilentCall: bool = False) -> None:
-        ## Save directory for any walk that my happen
-        sCurDir = os.getcwd()
+    async def run(self, bSkipOutput: bool = False, bIgnoreResults: bool = False, bSilentCall: bool = False, bStreamOutput: bool = False, bTrackStep: bool = True, iTimeout: int = 0) -> None:
+        ## Steps are timed per task, tasks running side by side don't cut each other's phases
+        rJob = JobRegistry_Singleton.get_current() if bTrackStep else None
+        try:
+            ## Long commands (compilation, big pulls) bring their own limit
+            await self.__run_commands(rJob, bSkipOutput, bIgnoreResults, bSilentCall, bStreamOutput, iTimeout or self.DEFAULT_TIMEOUT)
+        finally:
+            if rJob:
+                rJob.end_step(self)
+
+    async def __run_commands(self, rJob, bSkipOutput: bool, bIgnoreResults: bool, bSilentCall: bool, bStreamOutput: bool, iTimeout: int) -> None:
+        ## Walks are local to this run, process-wide cwd is never touched
+        sCurDir = self.sWorkDir
 
         for sCommand, sNotification in self.lCommand:
+            if rJob:
+                rJob.set_step(sNotification if len(sNotification) > 0 else sCommand, self)
+
             ## If there is any corresponding notification, send it now
             if len(sNotification) > 0 and not bSilentCall:
                 await self.rBroadcaster.send(sNotification)
 
             ## Check if command is a walk
-            if sCommand.find("cd") != -1:
+            if sCommand.startswith("cd "):
                 try:
-                    os.chdir(sCommand.strip("cd").strip(" "))
+                    sCurDir = self.__walk(sCurDir, sCommand[3:].strip())
                 except Exception as e:
                     self.lResults = [1, "", f"An error occured when trying to access path: {e}"]
                     ## Always check results before carry on (well.. with exception)
@@ -39,30 +94,111 @@ class BaseTask:
                         await self.results()
                     return
             else:
-                ## Fork a child
-                with subprocess.Popen(sCommand, shell=True, user=self.sUserName, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
-                    ## We cannot use proc.wait() due to lack of courtine implementation (block whole thread)
-                    ttStartTime = int(time.time())
-                    while proc.poll() == None:
-                        await gen.sleep(0.1)
-                        if int(time.time())-ttStartTime >= self.DEFAULT_TIMEOUT:
-                            break
-
-                    self.lResults = [proc.returncode, "".join(map(lambda item: item.decode(), proc.stdout.readlines())) if not bSkipOutput else "", "".join(map(lambda item: item.decode(), proc.stderr.readlines())) if not bSkipOutput else ""]
-
-                    ## Always check results before carry on (well.. with exception)
-                    if not bIgnoreResults:
-                        try:
-                            await self.results()
-                        except Exception:
-                            if len(self.lResults[2]) == 0:
-                                proc.terminate()
-
-                            os.chdir(sCurDir)
-                            return
-
-        ## Restore working dir
-        os.chdir(sCurDir)
+                ## Fork a child and wait for it without blocking the loop
+                self.lResults = await self.__execute(sCommand, sCurDir, bSkipOutput, bSilentCall, bStreamOutput, iTimeout)
+                if rJob:
+                    rJob.set_results(self.lResults)
+
+                ## Always check results before carry on (well.. with exception)
+                if not bIgnoreResults:
+                    try:
+                        await self.results()
+                    except Exception:
+                        return
+
+    def __walk(self, sCurDir: str | None, sPath: str) -> str:
+        sNewDir = os.path.normpath(os.path.join(sCurDir or os.getcwd(), os.path.expanduser(sPath)))
+        if not os.path.isdir(sNewDir):
+            raise FileNotFoundError(f"No such directory: '{sNewDir}'")
+
+        return sNewDir
+
+    async def __execute(self, sCommand: str, sCurDir: str | None, bSkipOutput: bool, bSilentCall: bool, bStreamOutput: bool, iTimeout: int) -> list:
+        ## Output nobody reads goes straight to devnull, so daemons started by the command can't hold our pipes
+        iPipe = asyncio.subprocess.DEVNULL if bSkipOutput else asyncio.subprocess.PIPE
+
+        ## Own session makes the child a group leader, so timeout can take down the whole tree
+        proc = await asyncio.create_subprocess_shell(sCommand, cwd=sCurDir, user=self.sUserName, stdout=iPipe, stderr=iPipe, start_new_session=True)
+
+        hSpool = self.__open_spool(sCommand, proc.pid) if not bSkipOutput else None
+        rStdout, rStderr = OutputCapture(self.OUTPUT_LIMIT, hSpool), OutputCapture(self.OUTPUT_LIMIT, hSpool)
+        lTail = deque(maxlen=self.STREAM_LINES)
+        lReaders = []
+        if not bSkipOutput:
+            lReaders = [asyncio.ensure_future(self.__read_pipe(proc.stdout, rStdout, lTail)), asyncio.ensure_future(self.__read_pipe(proc.stderr, rStderr, lTail))]
+
+        hProgress = None
+        if bStreamOutput and not bSkipOutput and not bSilentCall:
+            hProgress = asyncio.ensure_future(self.__stream_progress(lTail))
+
+        sTimeout = ""
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=iTimeout)
+        except asyncio.TimeoutError:
+            sTimeout = f"Command timed out after {iTimeout}s and was killed"
+            self.__kill_group(proc)
+            await proc.wait()
+        finally:
+            if hProgress:
+                hProgress.cancel()
+
+        ## Leftovers might still sit in pipes, give readers a moment to pick them up
+        if lReaders:
+            _, lPending = await asyncio.wait(lReaders, timeout=self.READER_GRACE)
+            for hReader in lPending:
+                hReader.cancel()
+
+        if hSpool:
+            hSpool.close()
+
+        sStdout = rStdout.get_value()
+        sStderr = rStderr.get_value()
+        if len(sTimeout) > 0:
+            sStderr = f"{sStderr}{sTimeout}"
+
+        return [proc.returncode, sStdout, sStderr]
+
+    def __open_spool(self, sCommand: str, iPid: int):
+        if len(self.OUTPUT_SPOOL_DIRECTORY) == 0:
+            return None
+
+        try:
+            os.makedirs(self.OUTPUT_SPOOL_DIRECTORY, exist_ok=True)
+            hSpool = open(os.path.join(self.OUTPUT_SPOOL_DIRECTORY, "{}-{}.log".format(time.strftime("%Y%m%d-%H%M%S"), iPid)), "wb")
+            hSpool.write(f"$ {sCommand}\n".encode())
+            return hSpool
+        except OSError as e:
+            log(f"Couldn't open output spool file: {e}", "warning")
+            return None
+
+    async def __read_pipe(self, hStream: asyncio.StreamReader, rCapture: OutputCapture, lTail: deque) -> None:
+        ## Keep pipe empty all the time, chatty commands would stall otherwise
+        while True:
+            bChunk = await hStream.read(65536)
+            if not bChunk:
+                return
+
+            rCapture.write(bChunk)
+            lTail.extend(line for line in bChunk.decode(errors="replace").splitlines() if len(line.strip()) > 0)
+
+    async def __stream_progress(self, lTail: deque) -> None:
+        ## Post last lines every interval, but only if something new showed up
+        ttStartTime = time.time()
+        lLastSent = []
+        while True:
+            await asyncio.sleep(self.STREAM_INTERVAL)
+            if len(lTail) == 0 or list(lTail) == lLastSent:
+                continue
+
+            lLastSent = list(lTail)
+            sLines = "\n".join(lLastSent)
+            await self.rBroadcaster.send(f"Still working ({int(time.time() - ttStartTime)}s), last output:\n```{sLines}```")
+
+    def __kill_group(self, proc: asyncio.subprocess.Process) -> None:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
 
     def check_results(self) -> bool:
         return self.lResults[0] == 0
@@ -1,5 +1,6 @@
 import re
 import os
+import json
 import logging
 
 from dotenv import load_dotenv
@@ -20,6 +21,8 @@ CONSTANTS: dict = {
     "COMPILATION_COMMAND" : os.getenv("COMPILATION_COMMAND"),
     "START_COMMAND" : os.getenv("START_COMMAND"),
     "STOP_COMMAND" : os.getenv("STOP_COMMAND"),
+    "CHANNEL_START_COMMAND" : os.getenv("CHANNEL_START_COMMAND", ""),
+    "CHANNEL_STOP_COMMAND" : os.getenv("CHANNEL_STOP_COMMAND", ""),
     "PATCHER_HOST" : os.getenv("PATCHER_HOST"),
     "PATCHER_ABSOLUTE_FILES_PATH" : os.getenv("PATCHER_ABSOLUTE_FILES_PATH"),
     "GAME_HOST" : os.getenv("GAME_HOST"),
@@ -27,6 +30,8 @@ CONSTANTS: dict = {
     "GAME_AUTH_PORT" : os.getenv("GAME_AUTH_PORT"),
     "GAME_PORTS_NAME" : os.getenv("GAME_PORTS_NAME").strip().split(","),
     "GAME_API_PASS" : os.getenv("GAME_API_PASS"),
+    "STATE_DIRECTORY" : os.getenv("STATE_DIRECTORY", ".tony"),
+    "CORE_BINARIES" : [sPath.strip() for sPath in os.getenv("CORE_BINARIES", "").split(",") if len(sPath.strip()) > 0],
 }
 
 LOGGING_TYPE: dict = {
@@ -79,3 +84,22 @@ def log(sTxt: str, sType: str="info") -> None:
 
 def get_remote_host(rRequest: str) -> str:
     return rRequest.headers.get("X-Real-IP") or rRequest.headers.get("X-Forwarded-For") or rRequest.remote_ip
+
+## Small json documents kept between runs (build marks, caches and so on)
+def load_state(sName: str) -> dict:
+    try:
+        with open(os.path.join(CONSTANTS["STATE_DIRECTORY"], f"{sName}.json"), "r", encoding="utf-8") as hFile:
+            return json.load(hFile)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(sName: str, dState: dict) -> None:
+    sPath = os.path.join(CONSTANTS["STATE_DIRECTORY"], f"{sName}.json")
+    try:
+        os.makedirs(CONSTANTS["STATE_DIRECTORY"], exist_ok=True)
+        with open(sPath + ".tmp", "w", encoding="utf-8") as hFile:
+            json.dump(dState, hFile)
+
+        os.replace(sPath + ".tmp", sPath)
+    except OSError as e:
+        log(f"Couldn't save state {sName}: {e}", "warning")